@@ -0,0 +1,170 @@
+import concurrent.futures
+import multiprocessing
+import threading
+import chess
+
+"""
+    Runs the AIs in a pool of long lived worker processes so that their searches never hold the web server's GIL.
+
+    A ProcessAI takes the place of an AI in a game. Each move sends the AI's type, settings and color and the position's
+    fen (and the game's moves as uci strings) to a worker process and only the move (as a uci string) is sent back. Each
+    worker keeps the AIs it creates so their transposition tables, search trees and caches are reused between moves.
+
+    A cancelled move is passed on to its worker through a flag in shared memory, each pool has an array of flags given
+    to its workers as they start and each move borrows one of them, the worker's search reads the move's flag as it
+    checks its time budget and stops.
+"""
+
+# how often (in seconds) an AI waiting on a worker process checks if its move has been cancelled
+CANCEL_POLL_INTERVAL = 0.05
+
+# the number of cancellation flags of each pool, the most moves of the pool's AIs which can be cancelled at once (a
+# move made while every flag is in use can not be cancelled once it has started)
+CANCEL_FLAGS = 256
+
+# the worker process pools, keyed by their number of workers and shared by every AI with the same number of workers
+worker_pools = {}
+worker_pools_lock = threading.Lock()
+
+# the AIs created in a worker process, keyed by their type, settings and color
+worker_engines = {}
+
+# the cancellation flags of the pool of a worker process, set as the worker starts
+worker_cancel_flags = None
+
+
+# set up a worker process as it starts
+def init_worker(cancel_flags):
+    global worker_cancel_flags
+    worker_cancel_flags = cancel_flags
+
+
+# a pool of worker processes and the flags its moves are cancelled through
+class WorkerPool:
+    def __init__(self, workers):
+        self.cancel_flags = multiprocessing.RawArray("b", CANCEL_FLAGS)
+        self.free_flags = list(range(CANCEL_FLAGS))
+        self.lock = threading.Lock()
+
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(self.cancel_flags,)
+        )
+
+    # borrow a cancellation flag for a move, returns the flag's index or None if every flag is in use
+    def claim_flag(self):
+        with self.lock:
+            if not self.free_flags:
+                return None
+
+            flag = self.free_flags.pop()
+
+        self.cancel_flags[flag] = 0
+        return flag
+
+    # return a cancellation flag once its move has finished in its worker
+    def release_flag(self, flag):
+        with self.lock:
+            self.free_flags.append(flag)
+
+
+# get the worker process pool with a given number of workers
+def get_worker_pool(workers):
+    with worker_pools_lock:
+        if workers not in worker_pools:
+            worker_pools[workers] = WorkerPool(workers)
+
+        return worker_pools[workers]
+
+
+# shut down every worker process pool
+def shutdown_worker_pools():
+    with worker_pools_lock:
+        for pool in worker_pools.values():
+            pool.executor.shutdown(wait=False)
+
+        worker_pools.clear()
+
+
+# the cancellation token of a move found in a worker process, cancelled through its flag in the pool's shared memory
+class WorkerCancellationToken:
+    def __init__(self, flag):
+        self.flag = flag
+
+    def is_cancelled(self):
+        return worker_cancel_flags[self.flag] != 0
+
+
+# find an AI's move in a worker process, returns the move as a uci string (or None if the AI has no move or the move
+# was cancelled through its cancellation flag) and the statistics of its search
+def find_worker_move(engine_type, settings, color, fen, moves=None, cancel_flag=None):
+    key = (engine_type, tuple(sorted(settings.items())), color)
+
+    engine = worker_engines.get(key)
+    if engine is None:
+        engine = engine_type(color=color, **settings)
+        worker_engines[key] = engine
+
+    if moves is not None:
+        moves = [chess.Move.from_uci(move) for move in moves]
+
+    cancel_token = WorkerCancellationToken(cancel_flag) if cancel_flag is not None else None
+
+    move = engine.get_move(fen, cancel_token, moves)
+
+    if move is None:
+        return None, engine.last_stats
+
+    return move.uci(), engine.last_stats
+
+
+# an AI which finds its moves in a worker process, engine_type is the class of the AI and settings are the arguments
+# it is created with (they must be picklable)
+class ProcessAI:
+    def __init__(self, engine_type, workers, color=None, **settings):
+        self.engine_type = engine_type
+        self.settings = settings
+        self.pool = get_worker_pool(workers)
+
+        self.color = None
+        self.change_color(color)
+
+        # the statistics of the AI's last move (a chess_ai.SearchStats)
+        self.last_stats = None
+
+    # allow a change in the AI's color
+    def change_color(self, color=None):
+        if color == "w" or color == "b":
+            self.color = color
+
+    # get the AI's move from a given fen (and the moves of the game so far if they are known), returns None if the move
+    # is cancelled through cancel_token (a CancellationToken), a cancelled move which has already started is stopped
+    # by its worker at the search's next budget check
+    def get_move(self, fen, cancel_token=None, moves=None):
+        if moves is not None:
+            moves = [move.uci() for move in moves]
+
+        cancel_flag = self.pool.claim_flag() if cancel_token is not None else None
+
+        future = self.pool.executor.submit(find_worker_move, self.engine_type, self.settings, self.color, fen, moves,
+                                           cancel_flag)
+
+        # the flag is only returned once the worker is done with the move, even if the move is cancelled before then
+        if cancel_flag is not None:
+            future.add_done_callback(lambda _: self.pool.release_flag(cancel_flag))
+
+        while True:
+            try:
+                move, self.last_stats = future.result(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except concurrent.futures.TimeoutError:
+                if cancel_token is not None and cancel_token.is_cancelled():
+                    if cancel_flag is not None:
+                        self.pool.cancel_flags[cancel_flag] = 1
+
+                    future.cancel()
+                    return None
+
+        if move is None:
+            return None
+
+        return chess.Move.from_uci(move)
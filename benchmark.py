@@ -0,0 +1,429 @@
+import argparse
+import json
+import math
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+import chess
+import chess_ai
+
+"""
+    Benchmarks of the AI engines.
+
+    Runs perft on standard test positions (checking the node counts are correct), times the board evaluation functions
+    and times each AI over a fixed set of positions, the results are written as JSON. Every timing is the median of a
+    number of rounds so that the results are not thrown off by whatever else the machine is doing.
+
+    A saved result can be used as a baseline, any metric which is worse than the baseline by more than its tolerance is
+    reported as a regression and the benchmark exits with status 1. Timings are scaled by a calibration loop before
+    they are compared, so a machine which is slower or busier than when the baseline was saved does not show up as a
+    regression. As the speed of a shared machine changes during a run the loop is timed around every round, each round
+    is measured against its own calibration and each group of results keeps the calibration its timings are given at.
+    Timings are given a wider tolerance than the counts (such as the nodes searched and the memory used) which are the
+    same on every run. At least MIN_BASELINE_ROUNDS rounds are run when comparing against a
+    baseline. On a shared machine (where the speed changes during a run) raise the timing tolerance.
+
+        python benchmark.py [--output results.json] [--baseline baseline.json] [--tolerance 0.3]
+                            [--count-tolerance 0.05] [--rounds 3] [--quick]
+"""
+
+# the fewest rounds run when the results are compared against a baseline, the median of fewer rounds is too noisy
+MIN_BASELINE_ROUNDS = 3
+
+# the shortest a timed round can be, work which takes less time is repeated within the round as the time of a very short
+# piece of work is mostly noise
+MIN_ROUND_SECONDS = 0.02
+
+# perft test positions and their node counts at each depth (from the chess programming wiki)
+PERFT_POSITIONS = [
+    ("start", chess.STARTING_FEN, [20, 400, 8902, 197281]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862]),
+    ("position_3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    ("position_4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467]),
+    ("position_5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379]),
+    ("position_6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890])
+]
+
+# the positions the AIs are timed on, openings, middle games and end games
+SEARCH_POSITIONS = [
+    chess.STARTING_FEN,
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "rnbqkb1r/pp2pppp/3p1n2/8/3NP3/8/PPP2PPP/RNBQKB1R w KQkq - 1 5",
+    "r1bq1rk1/ppp2ppp/2np1n2/2b1p3/2B1P3/2PP1N2/PP3PPP/RNBQ1RK1 w - - 1 7",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "2r2rk1/pp3ppp/2n1b3/3p4/3P4/2PB1N2/P4PPP/R4RK1 b - - 3 18",
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "8/8/4k3/8/2P5/4K3/8/8 w - - 0 1"
+]
+
+# the AIs which are benchmarked and the settings they are created with (without time limits so the work done is the
+# same on every run)
+BENCHMARK_AIS = [
+    ("RandomAI", chess_ai.RandomAI, {}),
+    ("PointAI", chess_ai.PointAI, {}),
+    ("AdvancedPointAI", chess_ai.AdvancedPointAI, {}),
+    ("MiniMaxAI", chess_ai.MiniMaxAI, {"depth": 2}),
+    ("AdvancedMiniMaxAI", chess_ai.AdvancedMiniMaxAI, {"depth": 2})
+]
+
+# how each metric is compared against the baseline, keyed by the last part of its name: "higher" and "lower" are
+# the better direction of a measurement, "equal" must not change (the slowest latencies are not compared, with one move
+# in each of a few positions they are a single measurement)
+METRIC_DIRECTIONS = {
+    "nodes_per_second": "higher",
+    "calls_per_second": "higher",
+    "p50": "lower",
+    "p90": "lower",
+    "peak_memory_kb": "lower",
+    "nodes": "lower",
+    "correct": "equal"
+}
+
+
+# count the leaf positions of the legal move tree of a board to a given depth
+def board_perft(board, depth):
+    if depth == 0:
+        return 1
+
+    nodes = 0
+    for move in board.valid_moves():
+        board.push(move)
+        nodes += board_perft(board, depth - 1)
+        board.pop()
+
+    return nodes
+
+
+# run perft on each perft position with a type of board, up to max_depth
+def benchmark_perft(board_type, max_depth, rounds):
+    positions = {}
+    total_nodes = 0
+    calibrations = []
+
+    for name, fen, counts in PERFT_POSITIONS:
+        board = board_type(fen)
+        depth = min(max_depth, len(counts))
+
+        if board_type is chess_ai.SearchBoard:
+            relative_time, nodes = time_rounds(lambda: chess_ai.perft(board, depth), rounds, calibrations)
+        else:
+            relative_time, nodes = time_rounds(lambda: board_perft(board, depth), rounds, calibrations)
+
+        positions[name] = {
+            "depth": depth,
+            "nodes": nodes,
+            "correct": nodes == counts[depth - 1],
+            "relative_time": relative_time
+        }
+
+        total_nodes += nodes
+
+    # the times are given at the group's calibration
+    calibration = statistics.median(calibrations)
+    total_seconds = 0.0
+    for position in positions.values():
+        position["seconds"] = position.pop("relative_time") * calibration
+        total_seconds += position["seconds"]
+
+    return {
+        "positions": positions,
+        "nodes": total_nodes,
+        "seconds": total_seconds,
+        "nodes_per_second": total_nodes / total_seconds,
+        "calibration_seconds": calibration
+    }
+
+
+# time the evaluation functions of a type of board with an evaluation backend
+def benchmark_evaluation(board_type, evaluation, calls, rounds):
+    boards = [board_type(fen, evaluation=evaluation) for fen in SEARCH_POSITIONS]
+    for board in boards:
+        board.count_pieces()
+
+    # calls each evaluation function of every board
+    def evaluate(name):
+        for _ in range(calls // len(boards)):
+            for board in boards:
+                getattr(board, name)(chess.WHITE)
+
+    relative_times = {}
+    calibrations = []
+    for name in ("calculate_score", "calculate_advanced_score"):
+        relative_times[name] = time_rounds(lambda: evaluate(name), rounds, calibrations)[0]
+
+    # the times are given at the group's calibration
+    calibration = statistics.median(calibrations)
+    results = {name: {"calls_per_second": (calls // len(boards)) * len(boards) / (relative_time * calibration)}
+               for name, relative_time in relative_times.items()}
+    results["calibration_seconds"] = calibration
+
+    return results
+
+
+# time a fixed amount of plain python work, used to compare the speed of the machine between runs
+def calibration_time(iterations=100000):
+    start = time.perf_counter()
+    total = 0
+    values = {}
+    for i in range(iterations):
+        total += i * i % 7
+        values[i & 1023] = total
+
+    return time.perf_counter() - start
+
+
+# the median time of the calibration loop over a number of rounds
+def benchmark_calibration(rounds):
+    return statistics.median(calibration_time(300000) for _ in range(rounds))
+
+
+# time a function over a number of rounds, returns the median of its time relative to the calibration loop (timed
+# before and after each round, the calibration times are added to calibrations) and the function's result, setup (if
+# given) is called outside of the timing before each call and its result is passed to the function, short functions
+# are called as many times as they need to take MIN_ROUND_SECONDS in each round
+def time_rounds(function, rounds, calibrations, setup=None):
+    # an untimed call to find how many calls each round makes
+    state = setup() if setup is not None else None
+    start = time.perf_counter()
+    result = function(state) if setup is not None else function()
+    calls = max(1, math.ceil(MIN_ROUND_SECONDS / max(time.perf_counter() - start, 1e-9)))
+
+    relative_times = []
+    for _ in range(rounds):
+        states = [setup() for _ in range(calls)] if setup is not None else None
+
+        calibration = calibration_time()
+
+        start = time.perf_counter()
+        for i in range(calls):
+            result = function(states[i]) if setup is not None else function()
+        seconds = (time.perf_counter() - start) / calls
+
+        calibration = (calibration + calibration_time()) / 2
+        calibrations.append(calibration)
+        relative_times.append(seconds / calibration)
+
+    return statistics.median(relative_times), result
+
+
+# the value at a percentile of a sorted list of values
+def percentile(values, percent):
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+
+    return values[index]
+
+
+# time an AI's move in each of the search positions
+def benchmark_ai(engine_type, settings, rounds):
+    relative_latencies = []
+    nodes = 0
+    calibrations = []
+
+    # find a move with an AI, returns the number of positions it visited
+    def find_move(ai, fen):
+        ai.get_move(fen)
+        return getattr(ai, "nodes", 0)
+
+    for fen in SEARCH_POSITIONS:
+        color = "w" if chess.Board(fen).turn == chess.WHITE else "b"
+
+        # a new AI for each move so that no move benefits from an earlier search
+        relative_latency, move_nodes = time_rounds(lambda ai: find_move(ai, fen), rounds, calibrations,
+                                                   setup=lambda: engine_type(color=color, **settings))
+
+        relative_latencies.append(relative_latency)
+        nodes += move_nodes
+
+    # the latencies are given at the group's calibration
+    calibration = statistics.median(calibrations)
+    latencies = [relative_latency * calibration for relative_latency in relative_latencies]
+
+    # the most memory allocated by creating the AI and finding a move (measured separately as tracing slows the AI)
+    tracemalloc.start()
+    ai = engine_type(color="w", **settings)
+    ai.get_move(SEARCH_POSITIONS[0])
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = sum(latencies)
+    latencies.sort()
+
+    result = {
+        "moves": len(latencies),
+        "seconds": seconds,
+        "latency_ms": {
+            "mean": seconds / len(latencies) * 1000,
+            "p50": percentile(latencies, 50) * 1000,
+            "p90": percentile(latencies, 90) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": latencies[-1] * 1000
+        },
+        "peak_memory_kb": peak_memory / 1024,
+        "calibration_seconds": calibration
+    }
+
+    # only the searching AIs count the positions they visit
+    if nodes:
+        result["nodes"] = nodes
+        result["nodes_per_second"] = nodes / seconds
+
+    return result
+
+
+# run every benchmark, quick runs shallower perft and fewer evaluation calls
+def run_benchmarks(quick=False, rounds=3, seed=0):
+    random.seed(seed)
+
+    perft_depth = 2 if quick else 3
+    calls = 100000 if quick else 500000
+
+    results = {
+        "python": platform.python_version(),
+        "chess": chess.__version__,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "quick": quick,
+        "rounds": rounds,
+        "perft": {},
+        "evaluation": {},
+        "ai": {},
+        "calibration_seconds": benchmark_calibration(rounds)
+    }
+
+    for board_type in (chess_ai.AIBoard, chess_ai.SearchBoard):
+        results["perft"][board_type.__name__] = benchmark_perft(board_type, perft_depth, rounds)
+
+        for evaluation in chess_ai.EVALUATION_BACKENDS:
+            results["evaluation"][board_type.__name__ + "/" + evaluation] = \
+                benchmark_evaluation(board_type, evaluation, calls, rounds)
+
+    for name, engine_type, settings in BENCHMARK_AIS:
+        results["ai"][name] = benchmark_ai(engine_type, settings, rounds)
+
+    # the peak memory of the whole process (ru_maxrss is in KB on linux)
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return results
+
+
+# flatten nested results into a dict of "a.b.c" names to values
+def flatten(results, prefix=""):
+    values = {}
+
+    for key, value in results.items():
+        name = prefix + key
+
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        else:
+            values[name] = value
+
+    return values
+
+
+# how much slower the machine was when a metric was measured than when it was measured for the baseline, found from the
+# calibration of the closest group of results holding the metric (the whole run's for results saved without them)
+def slowdown(name, values, baseline_values):
+    parts = name.split(".")[:-1]
+
+    while True:
+        calibration_name = ".".join(parts + ["calibration_seconds"])
+
+        if values.get(calibration_name) and baseline_values.get(calibration_name):
+            return values[calibration_name] / baseline_values[calibration_name]
+
+        if not parts:
+            return 1.0
+
+        parts.pop()
+
+
+# compare results against a baseline, returns a list of (metric, baseline value, value, change) for every metric which
+# is worse than the baseline by more than its tolerance (a fraction of the baseline value), tolerance is for the timings
+# and count_tolerance for the values which do not depend on the machine's speed
+def compare(results, baseline, tolerance, count_tolerance=0.05):
+    values = flatten(results)
+    regressions = []
+
+    baseline_values = flatten(baseline)
+
+    for name, baseline_value in baseline_values.items():
+        direction = METRIC_DIRECTIONS.get(name.rsplit(".", 1)[-1])
+
+        if direction is None or name not in values:
+            continue
+
+        value = values[name]
+
+        if direction == "equal":
+            if value != baseline_value:
+                regressions.append((name, baseline_value, value, None))
+            continue
+
+        if not baseline_value:
+            continue
+
+        # speeds are scaled up and times scaled down on a slower machine (memory and counts are not affected by its
+        # speed)
+        if name.endswith("_per_second"):
+            value *= slowdown(name, values, baseline_values)
+            allowed = tolerance
+        elif name.startswith("ai.") and ".latency_ms." in name:
+            value /= slowdown(name, values, baseline_values)
+            allowed = tolerance
+        else:
+            allowed = count_tolerance
+
+        change = (value - baseline_value) / baseline_value
+        if (direction == "higher" and change < -allowed) or (direction == "lower" and change > allowed):
+            regressions.append((name, baseline_value, value, change))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the chess AI engines.")
+    parser.add_argument("--output", help="the path to write the results to (default: standard output)")
+    parser.add_argument("--baseline", help="the path of saved results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="how much worse than the baseline a timing can be before it is a regression")
+    parser.add_argument("--count-tolerance", type=float, default=0.05,
+                        help="how much worse than the baseline a count (nodes, memory) can be before it is a regression")
+    parser.add_argument("--quick", action="store_true", help="run shallower perft and fewer evaluation calls")
+    parser.add_argument("--rounds", type=int, default=3, help="the number of times each benchmark is timed")
+    args = parser.parse_args()
+
+    rounds = args.rounds
+    if args.baseline:
+        rounds = max(rounds, MIN_BASELINE_ROUNDS)
+
+    benchmark_results = run_benchmarks(args.quick, rounds)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(benchmark_results, output, indent=2)
+    else:
+        print(json.dumps(benchmark_results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline_results = json.load(baseline_file)
+
+        found_regressions = compare(benchmark_results, baseline_results, args.tolerance, args.count_tolerance)
+
+        for metric, old_value, new_value, value_change in found_regressions:
+            if value_change is None:
+                print("REGRESSION " + metric + ": " + str(old_value) + " -> " + str(new_value), file=sys.stderr)
+            else:
+                print("REGRESSION " + metric + ": " + str(old_value) + " -> " + str(new_value) +
+                      " (" + format(value_change, "+.1%") + ")", file=sys.stderr)
+
+        if found_regressions:
+            sys.exit(1)
+
+        print("No regressions against " + args.baseline, file=sys.stderr)
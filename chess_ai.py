@@ -1,6 +1,12 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import chess
+import chess.polyglot
+import opening_book
+import collections
+import math
 import random
+import threading
+import time
 
 # <> advance scoring tables <>
 # white pawn modifier array
@@ -82,9 +88,25 @@ white_king_modifier = [ele for ele in reversed(black_king_modifier)]
 end_game_white_pawn_modifier = [ele for ele in reversed(end_game_black_pawn_modifier)]
 
 
+# the ways an AIBoard can evaluate a position:
+#   incremental - keep running scores which are updated by delta on push() and restored on pop()
+#   bitboard - calculate the scores when asked from the piece bitboards, iterating only over occupied squares
+EVALUATION_BACKENDS = ("incremental", "bitboard")
+
+
 # a custom board for the AI that allows it to get values like all possible moves and the current strength of the board
+# with the incremental backend the board keeps a running material and piece-square score (from white's point of view)
+# which is updated by delta on push() and restored on pop() so that scoring a position does not require a scan of the
+# board, the polyglot zobrist hash of the position is kept up to date the same way
 class AIBoard(chess.Board):
-    def __init__(self, fen="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"):
+    def __init__(self, fen="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", evaluation="incremental"):
+        if evaluation not in EVALUATION_BACKENDS:
+            raise ValueError("unknown evaluation backend: " + str(evaluation))
+
+        # set before the board is set up as setting up the board calculates the scores
+        self.evaluation = evaluation
+        self._incremental = evaluation == "incremental"
+
         super().__init__(fen=fen)
 
         self.num_pieces = 0
@@ -99,72 +121,225 @@ class AIBoard(chess.Board):
 
     # calculates the score of a given side
     def calculate_score(self, side_color):
-        # the ongoing score of the board
-        score = 0
+        # scores are kept from white's point of view
+        if self._incremental:
+            score = self.material_score
+        else:
+            score = self.bitboard_material_score()
 
-        # go through each square
-        for square in range(0, 64):
-            # get the piece at the current square
-            piece = self.piece_at(square)
+        if side_color == chess.WHITE:
+            return score
 
-            # pass if there is no piece on the square
-            if piece is None:
-                continue
+        return -score
 
-            # if the current piece belongs to the side we are scoring then add it as a positive, otherwise a negative
-            if piece.color == side_color:
-                score += piece_score(piece.piece_type)
-            if piece.color != side_color:
-                score -= piece_score(piece.piece_type)
+    def calculate_advanced_score(self, side_color):
+        # use the middle game tables while there are more than 10 pieces on the board, otherwise the end game tables
+        if self.num_pieces > 10:
+            if self._incremental:
+                score = self.middle_game_score
+            else:
+                score = self.bitboard_table_score(middle_game_table)
+        else:
+            if self._incremental:
+                score = self.end_game_score
+            else:
+                score = self.bitboard_table_score(end_game_table)
 
-        # return the score for that player
-        return score
+        # scores are kept from white's point of view
+        if side_color == chess.WHITE:
+            return score
 
-    def calculate_advanced_score(self, side_color):
-        # the ongoing score of the board
+        return -score
+
+    # counts the number of pieces on the board
+    def count_pieces(self):
+        if self._incremental:
+            self.num_pieces = self.piece_count
+        else:
+            self.num_pieces = chess.popcount(self.occupied)
+
+        return self.num_pieces
+
+    # calculate the material score from white's point of view using a popcount of each piece bitboard
+    def bitboard_material_score(self):
         score = 0
 
-        # go through each square
-        for square in range(0, 64):
-            # get the piece at the current square
-            piece = self.piece_at(square)
+        for color in chess.COLORS:
+            occupied = self.occupied_co[color]
+            values = material_table[color]
 
-            # pass if there is no piece on the square
-            if piece is None:
-                continue
+            score += values[chess.PAWN] * chess.popcount(self.pawns & occupied)
+            score += values[chess.KNIGHT] * chess.popcount(self.knights & occupied)
+            score += values[chess.BISHOP] * chess.popcount(self.bishops & occupied)
+            score += values[chess.ROOK] * chess.popcount(self.rooks & occupied)
+            score += values[chess.QUEEN] * chess.popcount(self.queens & occupied)
+            score += values[chess.KING] * chess.popcount(self.kings & occupied)
 
-            if self.num_pieces > 10:
-                # if the current piece belongs to the side we are scoring then add it as a positive, otherwise a negative
-                if piece.color == side_color:
-                    score += advanced_piece_score(piece.piece_type, square, piece.color)
-                if piece.color != side_color:
-                    score -= advanced_piece_score(piece.piece_type, square, piece.color)
-            else:
-                # if the current piece belongs to the side we are scoring then add it as a positive, otherwise a negative
-                if piece.color == side_color:
-                    score += advanced_end_game_piece_score(piece.piece_type, square, piece.color)
-                if piece.color != side_color:
-                    score -= advanced_end_game_piece_score(piece.piece_type, square, piece.color)
+        return score
+
+    # calculate a piece-square score from white's point of view by looking up only the occupied squares of each piece
+    # bitboard in the given score table
+    def bitboard_table_score(self, table):
+        score = 0
+
+        for color in chess.COLORS:
+            for piece_type in chess.PIECE_TYPES:
+                values = table[color][piece_type]
+
+                for square in chess.scan_reversed(self.pieces_mask(piece_type, color)):
+                    score += values[square]
 
-        # return the score for that player
         return score
 
-    # counts the number of pieces on the board
-    def count_pieces(self):
-        num = 0
+    # make a move and update the zobrist hash and running scores by the change in the squares touched by the move
+    def push(self, move):
+        # save the current hash and scores so that pop() can restore them
+        self._undo_stack.append((self.zobrist, self._zobrist_castling, self.material_score, self.middle_game_score,
+                                 self.end_game_score, self.piece_count))
 
-        # go through each square
-        for square in range(0, 64):
-            # get the piece at the current square
-            piece = self.piece_at(square)
+        squares = self._touched_squares(move)
+        castling_rights = self.castling_rights
 
-            # pass if there is no piece on the square
-            if piece is None:
-                continue
-            else:
-                num += 1
+        # remove the en passant file from the hash and the touched squares from the hash and scores
+        self.zobrist ^= zobrist_hasher.hash_ep_square(self)
+        for square in squares:
+            self._remove_square(square)
+
+        super().push(move)
+
+        # add the touched squares back to the hash and scores along with the new en passant file and the turn change
+        for square in squares:
+            self._add_square(square)
+        self.zobrist ^= zobrist_hasher.hash_ep_square(self) ^ zobrist_turn_key
+
+        # castling rights only change when a king or rook moves or a rook is captured
+        if self.castling_rights != castling_rights:
+            zobrist_castling = zobrist_hasher.hash_castling(self)
+            self.zobrist ^= self._zobrist_castling ^ zobrist_castling
+            self._zobrist_castling = zobrist_castling
+
+    # undo a move and restore the hash and scores from before it was made
+    def pop(self):
+        move = super().pop()
+
+        (self.zobrist, self._zobrist_castling, self.material_score, self.middle_game_score, self.end_game_score,
+         self.piece_count) = self._undo_stack.pop()
+
+        return move
+
+    # recalculate the zobrist hash and running scores from scratch, needed whenever the board is changed other than by
+    # push() or pop()
+    def refresh_scores(self):
+        self._undo_stack = []
+
+        self.zobrist = zobrist_hasher(self)
+        self._zobrist_castling = zobrist_hasher.hash_castling(self)
+
+        # the bitboard backend has no running scores to keep
+        if not self._incremental:
+            self.material_score = 0
+            self.middle_game_score = 0
+            self.end_game_score = 0
+            self.piece_count = 0
+            return
+
+        self.material_score = self.bitboard_material_score()
+        self.middle_game_score = self.bitboard_table_score(middle_game_table)
+        self.end_game_score = self.bitboard_table_score(end_game_table)
+        self.piece_count = chess.popcount(self.occupied)
+
+    def set_fen(self, fen):
+        super().set_fen(fen)
+        self.refresh_scores()
+
+    def set_board_fen(self, fen):
+        super().set_board_fen(fen)
+        self.refresh_scores()
+
+    def set_piece_map(self, pieces):
+        super().set_piece_map(pieces)
+        self.refresh_scores()
+
+    def set_piece_at(self, square, piece, promoted=False):
+        super().set_piece_at(square, piece, promoted)
+        self.refresh_scores()
+
+    def remove_piece_at(self, square):
+        piece = super().remove_piece_at(square)
+        self.refresh_scores()
+
+        return piece
+
+    def reset_board(self):
+        super().reset_board()
+        self.refresh_scores()
+
+    def clear_board(self):
+        super().clear_board()
+        self.refresh_scores()
+
+    def copy(self, *, stack=True):
+        board = super().copy(stack=stack)
+
+        # use the same evaluation backend as this board
+        board.evaluation = self.evaluation
+        board._incremental = self._incremental
+
+        # the copy is built by setting the piece masks directly so its hash and scores have to be recalculated, then the
+        # saved hashes and scores of any copied moves are carried over so they can still be popped
+        board.refresh_scores()
+        if board.move_stack:
+            board._undo_stack = self._undo_stack[-len(board.move_stack):]
+
+        return board
+
+    # the squares whose contents change when a move is made
+    def _touched_squares(self, move):
+        # castling can move the king and the rook anywhere on the back rank
+        if self.is_castling(move):
+            return chess.SquareSet(chess.BB_RANK_1 if self.turn == chess.WHITE else chess.BB_RANK_8)
+
+        # en passant removes a pawn from a square other than the destination
+        if self.is_en_passant(move):
+            return move.from_square, move.to_square, move.to_square + (-8 if self.turn == chess.WHITE else 8)
 
-        self.num_pieces = num
+        return move.from_square, move.to_square
+
+    # add the piece on a square to the zobrist hash and running scores
+    def _add_square(self, square):
+        piece_type = self.piece_type_at(square)
+
+        # pass if there is no piece on the square
+        if piece_type is None:
+            return
+
+        color = bool(self.occupied_co[chess.WHITE] & chess.BB_SQUARES[square])
+
+        self.zobrist ^= zobrist_table[color][piece_type][square]
+
+        if self._incremental:
+            self.material_score += material_table[color][piece_type]
+            self.middle_game_score += middle_game_table[color][piece_type][square]
+            self.end_game_score += end_game_table[color][piece_type][square]
+            self.piece_count += 1
+
+    # remove the piece on a square from the zobrist hash and running scores
+    def _remove_square(self, square):
+        piece_type = self.piece_type_at(square)
+
+        # pass if there is no piece on the square
+        if piece_type is None:
+            return
+
+        color = bool(self.occupied_co[chess.WHITE] & chess.BB_SQUARES[square])
+
+        self.zobrist ^= zobrist_table[color][piece_type][square]
+
+        if self._incremental:
+            self.material_score -= material_table[color][piece_type]
+            self.middle_game_score -= middle_game_table[color][piece_type][square]
+            self.end_game_score -= end_game_table[color][piece_type][square]
+            self.piece_count -= 1
 
 
 # get a score based on a piece type
@@ -268,10 +443,1138 @@ def advanced_end_game_piece_score(piece_type, position, color):
             return black_king_modifier[position] + 1000
 
 
+# <> running score tables <>
+# the value each piece adds to the board score from white's point of view (black pieces are negative), indexed by
+# [color][piece_type] for material and [color][piece_type][square] for the advanced middle and end game scores
+material_table = [[0] * 7, [0] * 7]
+middle_game_table = [[[0] * 64 for _ in range(7)], [[0] * 64 for _ in range(7)]]
+end_game_table = [[[0] * 64 for _ in range(7)], [[0] * 64 for _ in range(7)]]
+
+for table_color in chess.COLORS:
+    table_sign = 1 if table_color == chess.WHITE else -1
+
+    for table_piece_type in chess.PIECE_TYPES:
+        material_table[table_color][table_piece_type] = table_sign * piece_score(table_piece_type)
+
+        for table_square in chess.SQUARES:
+            middle_game_table[table_color][table_piece_type][table_square] = \
+                table_sign * advanced_piece_score(table_piece_type, table_square, table_color)
+            end_game_table[table_color][table_piece_type][table_square] = \
+                table_sign * advanced_end_game_piece_score(table_piece_type, table_square, table_color)
+
+
+# <> zobrist hashing tables <>
+# the board's zobrist hash uses the polyglot keys so it matches chess.polyglot.zobrist_hash
+zobrist_hasher = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+zobrist_turn_key = chess.polyglot.POLYGLOT_RANDOM_ARRAY[780]
+
+# the key of each piece on each square, indexed by [color][piece_type][square]
+zobrist_table = [[[0] * 64 for _ in range(7)], [[0] * 64 for _ in range(7)]]
+
+for table_color in chess.COLORS:
+    for table_piece_type in chess.PIECE_TYPES:
+        for table_square in chess.SQUARES:
+            zobrist_table[table_color][table_piece_type][table_square] = \
+                chess.polyglot.POLYGLOT_RANDOM_ARRAY[64 * ((table_piece_type - 1) * 2 + table_color) + table_square]
+
+
+# <> search board <>
+# the moves generated by the search board, made once so that generating moves does not create move objects, indexed by
+# [from_square][to_square], promotions are indexed by from_square * 64 + to_square and are in python-chess' order
+search_moves = [[chess.Move(from_square, to_square) for to_square in chess.SQUARES] for from_square in chess.SQUARES]
+search_promotions = {}
+
+for table_from_square in chess.SQUARES:
+    for table_to_square in chess.SQUARES:
+        if abs(chess.square_file(table_from_square) - chess.square_file(table_to_square)) > 1:
+            continue
+
+        if (chess.square_rank(table_from_square), chess.square_rank(table_to_square)) in ((6, 7), (1, 0)):
+            search_promotions[table_from_square * 64 + table_to_square] = [
+                chess.Move(table_from_square, table_to_square, promotion)
+                for promotion in (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT)]
+
+# the rook move made by each castling move, keyed by the king's destination square
+castling_rook_moves = {chess.G1: (chess.H1, chess.F1), chess.C1: (chess.A1, chess.D1),
+                       chess.G8: (chess.H8, chess.F8), chess.C8: (chess.A8, chess.D8)}
+
+# the squares of the rooks which castling rights can belong to
+castling_rook_squares = chess.BB_A1 | chess.BB_H1 | chess.BB_A8 | chess.BB_H8
+
+# the zobrist key of each set of castling rights (a mask of the rooks which can still castle)
+castling_zobrist = {}
+
+for table_rights in range(16):
+    table_mask = 0
+    table_key = 0
+
+    for table_index, table_rook in enumerate((chess.H1, chess.A1, chess.H8, chess.A8)):
+        if table_rights & (1 << table_index):
+            table_mask |= chess.BB_SQUARES[table_rook]
+            table_key ^= chess.polyglot.POLYGLOT_RANDOM_ARRAY[768 + table_index]
+
+    castling_zobrist[table_mask] = table_key
+
+# the zobrist key of the en passant file
+zobrist_ep_keys = [chess.polyglot.POLYGLOT_RANDOM_ARRAY[772 + chess.square_file(square)] for square in chess.SQUARES]
+
+
+# a board used only by the searches, moves are made and unmade with as little work as possible: the position is kept
+# as piece bitboards and a square to piece type table, moves are generated pseudo-legally (a move which leaves the
+# king in check is only found when it is made, see was_into_check()) and no move history other than what is needed to
+# unmake moves is kept, the zobrist hash and running scores are kept the same way as an AIBoard
+class SearchBoard:
+    __slots__ = ("pieces", "piece_types", "occupied_co", "occupied", "turn", "castling_rights", "ep_square",
+                 "halfmove_clock", "fullmove_number", "zobrist", "_zobrist_ep", "material_score", "middle_game_score",
+                 "end_game_score", "piece_count", "num_pieces", "evaluation", "_incremental", "move_stack",
+                 "_undo_stack")
+
+    def __init__(self, fen=chess.STARTING_FEN, evaluation="incremental"):
+        if evaluation not in EVALUATION_BACKENDS:
+            raise ValueError("unknown evaluation backend: " + str(evaluation))
+
+        self.evaluation = evaluation
+        self._incremental = evaluation == "incremental"
+
+        self.num_pieces = 0
+
+        self.set_fen(fen)
+
+    def set_fen(self, fen):
+        self.set_board(chess.Board(fen))
+
+    # set up the position of a chess.Board, its move stack is not copied
+    def set_board(self, board):
+        # the bitboard of each piece type of each color, indexed by [color][piece_type], and the piece type on each
+        # square (0 if the square is empty)
+        self.pieces = [[0] * 7, [0] * 7]
+        self.piece_types = [0] * 64
+
+        for color in chess.COLORS:
+            for piece_type in chess.PIECE_TYPES:
+                mask = board.pieces_mask(piece_type, color)
+                self.pieces[color][piece_type] = mask
+
+                for square in chess.scan_reversed(mask):
+                    self.piece_types[square] = piece_type
+
+        self.occupied_co = [board.occupied_co[chess.BLACK], board.occupied_co[chess.WHITE]]
+        self.occupied = board.occupied
+
+        self.turn = board.turn
+        self.castling_rights = board.clean_castling_rights() & castling_rook_squares
+        self.ep_square = board.ep_square
+        self.halfmove_clock = board.halfmove_clock
+        self.fullmove_number = board.fullmove_number
+
+        self.zobrist = zobrist_hasher(board)
+        self._zobrist_ep = zobrist_hasher.hash_ep_square(board)
+
+        if self._incremental:
+            self.material_score = self.bitboard_material_score()
+            self.middle_game_score = self.bitboard_table_score(middle_game_table)
+            self.end_game_score = self.bitboard_table_score(end_game_table)
+            self.piece_count = chess.popcount(self.occupied)
+        else:
+            self.material_score = 0
+            self.middle_game_score = 0
+            self.end_game_score = 0
+            self.piece_count = 0
+
+        # the moves made on the board and what is needed to unmake them
+        self.move_stack = []
+        self._undo_stack = []
+
+    # returns a chess.Board of the position
+    def to_board(self):
+        board = chess.Board(None)
+
+        white = self.pieces[chess.WHITE]
+        black = self.pieces[chess.BLACK]
+        board.pawns = white[chess.PAWN] | black[chess.PAWN]
+        board.knights = white[chess.KNIGHT] | black[chess.KNIGHT]
+        board.bishops = white[chess.BISHOP] | black[chess.BISHOP]
+        board.rooks = white[chess.ROOK] | black[chess.ROOK]
+        board.queens = white[chess.QUEEN] | black[chess.QUEEN]
+        board.kings = white[chess.KING] | black[chess.KING]
+        board.occupied_co[chess.WHITE] = self.occupied_co[chess.WHITE]
+        board.occupied_co[chess.BLACK] = self.occupied_co[chess.BLACK]
+        board.occupied = self.occupied
+
+        board.turn = self.turn
+        board.castling_rights = self.castling_rights
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+
+        return board
+
+    def fen(self):
+        return self.to_board().fen()
+
+    # get a list of the valid legal moves
+    def valid_moves(self):
+        moves = []
+        self.add_pseudo_legal_moves(moves)
+
+        return self.legal_only(moves)
+
+    # gets a random valid move (None if there are none), only the moves picked are checked for legality, moves is a list
+    # to generate the pseudo-legal moves into (so a caller picking many moves can reuse one list)
+    def random_move(self, moves=None):
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
+        self.add_pseudo_legal_moves(moves)
+
+        # pick moves at random until one does not leave the king in check, illegal moves are removed from the list
+        while moves:
+            index = random.randrange(len(moves))
+            move = moves[index]
+
+            self.push(move)
+            legal = not self.was_into_check()
+            self.pop()
+
+            if legal:
+                return move
+
+            moves[index] = moves[-1]
+            moves.pop()
+
+        return None
+
+    def generate_legal_moves(self):
+        return iter(self.valid_moves())
+
+    def generate_legal_captures(self):
+        moves = []
+        self.add_pseudo_legal_moves(moves, captures_only=True)
+
+        return iter(self.legal_only(moves))
+
+    def is_legal(self, move):
+        return move in self.valid_moves()
+
+    # the moves of a list of pseudo-legal moves which do not leave the king in check, in python-chess' order of its
+    # legal moves (in check python-chess generates the king's moves before the other moves)
+    def legal_only(self, moves):
+        legal_moves = []
+
+        for move in moves:
+            self.push(move)
+            if not self.was_into_check():
+                legal_moves.append(move)
+            self.pop()
+
+        if self.is_check():
+            king = self.pieces[self.turn][chess.KING]
+            king_moves = [move for move in legal_moves if chess.BB_SQUARES[move.from_square] & king]
+
+            if king_moves:
+                legal_moves = king_moves + [move for move in legal_moves
+                                            if not chess.BB_SQUARES[move.from_square] & king]
+
+        return legal_moves
+
+    # add the pseudo-legal moves of the position to a list (in python-chess' order of its pseudo-legal moves: the other
+    # pieces from the highest square down, each to the highest square first, then castling king side first, then pawn
+    # captures, pushes, double pushes and en passant), only captures (including en passant and promotions which
+    # capture) if captures_only is True
+    def add_pseudo_legal_moves(self, moves, captures_only=False):
+        append = moves.append
+        turn = self.turn
+        pieces = self.pieces[turn]
+        piece_types = self.piece_types
+        own = self.occupied_co[turn]
+        opponent = self.occupied_co[not turn]
+        occupied = self.occupied
+        bb_squares = chess.BB_SQUARES
+
+        if captures_only:
+            targets = opponent
+        else:
+            targets = ~own & chess.BB_ALL
+
+        # moves of every piece other than pawns, from the highest square to the lowest
+        from_squares = own & ~pieces[chess.PAWN]
+        while from_squares:
+            from_square = from_squares.bit_length() - 1
+            from_squares ^= bb_squares[from_square]
+
+            piece_type = piece_types[from_square]
+            if piece_type == chess.KNIGHT:
+                to_squares = chess.BB_KNIGHT_ATTACKS[from_square]
+            elif piece_type == chess.BISHOP:
+                to_squares = chess.BB_DIAG_ATTACKS[from_square][chess.BB_DIAG_MASKS[from_square] & occupied]
+            elif piece_type == chess.ROOK:
+                to_squares = (chess.BB_RANK_ATTACKS[from_square][chess.BB_RANK_MASKS[from_square] & occupied] |
+                              chess.BB_FILE_ATTACKS[from_square][chess.BB_FILE_MASKS[from_square] & occupied])
+            elif piece_type == chess.QUEEN:
+                to_squares = (chess.BB_DIAG_ATTACKS[from_square][chess.BB_DIAG_MASKS[from_square] & occupied] |
+                              chess.BB_RANK_ATTACKS[from_square][chess.BB_RANK_MASKS[from_square] & occupied] |
+                              chess.BB_FILE_ATTACKS[from_square][chess.BB_FILE_MASKS[from_square] & occupied])
+            else:
+                to_squares = chess.BB_KING_ATTACKS[from_square]
+
+            to_squares &= targets
+            row = search_moves[from_square]
+            while to_squares:
+                to_square = to_squares.bit_length() - 1
+                to_squares ^= bb_squares[to_square]
+                append(row[to_square])
+
+        # castling, the king may not castle out of or through check (castling into check is found when it is made)
+        if self.castling_rights and not captures_only:
+            self.add_castling_moves(moves)
+
+        pawns = pieces[chess.PAWN]
+        if not pawns:
+            return
+
+        # pawn captures
+        pawn_attacks = chess.BB_PAWN_ATTACKS[turn]
+        from_squares = pawns
+        while from_squares:
+            from_square = from_squares.bit_length() - 1
+            from_squares ^= bb_squares[from_square]
+
+            to_squares = pawn_attacks[from_square] & opponent
+            while to_squares:
+                to_square = to_squares.bit_length() - 1
+                to_squares ^= bb_squares[to_square]
+
+                if bb_squares[to_square] & chess.BB_BACKRANKS:
+                    moves.extend(search_promotions[from_square * 64 + to_square])
+                else:
+                    append(search_moves[from_square][to_square])
+
+        # pawn pushes
+        if not captures_only:
+            if turn == chess.WHITE:
+                single_moves = pawns << 8 & ~occupied
+                double_moves = single_moves << 8 & ~occupied & chess.BB_RANK_4
+                offset = -8
+            else:
+                single_moves = pawns >> 8 & ~occupied
+                double_moves = single_moves >> 8 & ~occupied & chess.BB_RANK_5
+                offset = 8
+
+            while single_moves:
+                to_square = single_moves.bit_length() - 1
+                single_moves ^= bb_squares[to_square]
+
+                if bb_squares[to_square] & chess.BB_BACKRANKS:
+                    moves.extend(search_promotions[(to_square + offset) * 64 + to_square])
+                else:
+                    append(search_moves[to_square + offset][to_square])
+
+            while double_moves:
+                to_square = double_moves.bit_length() - 1
+                double_moves ^= bb_squares[to_square]
+                append(search_moves[to_square + 2 * offset][to_square])
+
+        # en passant
+        ep_square = self.ep_square
+        if ep_square is not None and not occupied & bb_squares[ep_square]:
+            from_squares = pawns & chess.BB_PAWN_ATTACKS[not turn][ep_square] & chess.BB_RANKS[4 if turn else 3]
+            while from_squares:
+                from_square = from_squares.bit_length() - 1
+                from_squares ^= bb_squares[from_square]
+                append(search_moves[from_square][ep_square])
+
+    # add the castling moves of the side to move, the king must not be in check or pass through an attacked square
+    def add_castling_moves(self, moves):
+        turn = self.turn
+        king = self.pieces[turn][chess.KING]
+        if turn == chess.WHITE:
+            king_square, rights = chess.E1, self.castling_rights & chess.BB_RANK_1
+        else:
+            king_square, rights = chess.E8, self.castling_rights & chess.BB_RANK_8
+
+        if not rights or not king & chess.BB_SQUARES[king_square]:
+            return
+
+        opponent = not turn
+        if self.is_attacked_by(opponent, king_square):
+            return
+
+        occupied = self.occupied
+        rooks = self.pieces[turn][chess.ROOK]
+
+        # king side first, the same order as python-chess
+        rook_square = king_square + 3
+        if rights & rooks & chess.BB_SQUARES[rook_square]:
+            if not occupied & (chess.BB_SQUARES[king_square + 1] | chess.BB_SQUARES[king_square + 2]):
+                if not self.is_attacked_by(opponent, king_square + 1):
+                    moves.append(search_moves[king_square][king_square + 2])
+
+        rook_square = king_square - 4
+        if rights & rooks & chess.BB_SQUARES[rook_square]:
+            if not occupied & (chess.BB_SQUARES[king_square - 1] | chess.BB_SQUARES[king_square - 2] |
+                               chess.BB_SQUARES[king_square - 3]):
+                if not self.is_attacked_by(opponent, king_square - 1):
+                    moves.append(search_moves[king_square][king_square - 2])
+
+    # check if a square is attacked by a color
+    def is_attacked_by(self, color, square):
+        pieces = self.pieces[color]
+        occupied = self.occupied
+
+        if chess.BB_KNIGHT_ATTACKS[square] & pieces[chess.KNIGHT]:
+            return True
+
+        if chess.BB_PAWN_ATTACKS[not color][square] & pieces[chess.PAWN]:
+            return True
+
+        if chess.BB_KING_ATTACKS[square] & pieces[chess.KING]:
+            return True
+
+        queens = pieces[chess.QUEEN]
+        if chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied] & (pieces[chess.BISHOP] | queens):
+            return True
+
+        return bool((chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] |
+                     chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied]) &
+                    (pieces[chess.ROOK] | queens))
+
+    # check if the side to move is in check
+    def is_check(self):
+        king = self.pieces[self.turn][chess.KING]
+
+        return bool(king) and self.is_attacked_by(not self.turn, king.bit_length() - 1)
+
+    # check if the last move left the king of the side which made it in check (the move was not legal)
+    def was_into_check(self):
+        king = self.pieces[not self.turn][chess.KING]
+
+        return bool(king) and self.is_attacked_by(self.turn, king.bit_length() - 1)
+
+    def gives_check(self, move):
+        self.push(move)
+        check = self.is_check()
+        self.pop()
+
+        return check
+
+    def piece_type_at(self, square):
+        return self.piece_types[square] or None
+
+    def is_capture(self, move):
+        return bool(self.piece_types[move.to_square]) or self.is_en_passant(move)
+
+    def is_en_passant(self, move):
+        return (move.to_square == self.ep_square and self.piece_types[move.from_square] == chess.PAWN and
+                not self.piece_types[move.to_square] and abs(move.to_square - move.from_square) in (7, 9))
+
+    def is_castling(self, move):
+        return self.piece_types[move.from_square] == chess.KING and abs(move.to_square - move.from_square) == 2
+
+    # make a (pseudo-legal) move, updating the zobrist hash and running scores by the change in the squares it touches
+    def push(self, move):
+        from_square = move.from_square
+        to_square = move.to_square
+        promotion = move.promotion
+
+        color = self.turn
+        opponent = not color
+        piece_types = self.piece_types
+        piece_type = piece_types[from_square]
+        captured = piece_types[to_square]
+
+        self.move_stack.append(move)
+        self._undo_stack.append((captured, self.castling_rights, self.ep_square, self.halfmove_clock, self.zobrist,
+                                 self._zobrist_ep, self.material_score, self.middle_game_score, self.end_game_score,
+                                 self.piece_count))
+
+        from_bb = chess.BB_SQUARES[from_square]
+        to_bb = chess.BB_SQUARES[to_square]
+        pieces = self.pieces[color]
+        occupied_co = self.occupied_co
+        incremental = self._incremental
+
+        zobrist = self.zobrist ^ self._zobrist_ep ^ zobrist_turn_key
+        keys = zobrist_table[color]
+        middle_game = middle_game_table[color]
+        end_game = end_game_table[color]
+
+        halfmove_clock = self.halfmove_clock + 1
+
+        # remove a captured piece
+        if captured:
+            self.pieces[opponent][captured] ^= to_bb
+            occupied_co[opponent] ^= to_bb
+            zobrist ^= zobrist_table[opponent][captured][to_square]
+            halfmove_clock = 0
+
+            if incremental:
+                self.material_score -= material_table[opponent][captured]
+                self.middle_game_score -= middle_game_table[opponent][captured][to_square]
+                self.end_game_score -= end_game_table[opponent][captured][to_square]
+                self.piece_count -= 1
+
+        # move the piece, a promoted pawn is replaced by the promotion piece
+        new_type = promotion or piece_type
+        pieces[piece_type] ^= from_bb
+        pieces[new_type] ^= to_bb
+        occupied_co[color] ^= from_bb | to_bb
+        piece_types[from_square] = 0
+        piece_types[to_square] = new_type
+        zobrist ^= keys[piece_type][from_square] ^ keys[new_type][to_square]
+
+        if incremental:
+            self.middle_game_score += middle_game[new_type][to_square] - middle_game[piece_type][from_square]
+            self.end_game_score += end_game[new_type][to_square] - end_game[piece_type][from_square]
+            if promotion:
+                self.material_score += material_table[color][promotion] - material_table[color][chess.PAWN]
+
+        ep_square = None
+        if piece_type == chess.PAWN:
+            halfmove_clock = 0
+
+            if to_square - from_square in (16, -16):
+                ep_square = (from_square + to_square) >> 1
+            elif to_square == self.ep_square and not captured:
+                # en passant removes the pawn which made the double move
+                capture_square = to_square - 8 if color == chess.WHITE else to_square + 8
+                capture_bb = chess.BB_SQUARES[capture_square]
+                self.pieces[opponent][chess.PAWN] ^= capture_bb
+                occupied_co[opponent] ^= capture_bb
+                piece_types[capture_square] = 0
+                zobrist ^= zobrist_table[opponent][chess.PAWN][capture_square]
+
+                if incremental:
+                    self.material_score -= material_table[opponent][chess.PAWN]
+                    self.middle_game_score -= middle_game_table[opponent][chess.PAWN][capture_square]
+                    self.end_game_score -= end_game_table[opponent][chess.PAWN][capture_square]
+                    self.piece_count -= 1
+        elif piece_type == chess.KING and to_square - from_square in (2, -2):
+            # castling also moves the rook
+            rook_from, rook_to = castling_rook_moves[to_square]
+            rook_bb = chess.BB_SQUARES[rook_from] | chess.BB_SQUARES[rook_to]
+            pieces[chess.ROOK] ^= rook_bb
+            occupied_co[color] ^= rook_bb
+            piece_types[rook_from] = 0
+            piece_types[rook_to] = chess.ROOK
+            zobrist ^= keys[chess.ROOK][rook_from] ^ keys[chess.ROOK][rook_to]
+
+            if incremental:
+                self.middle_game_score += middle_game[chess.ROOK][rook_to] - middle_game[chess.ROOK][rook_from]
+                self.end_game_score += end_game[chess.ROOK][rook_to] - end_game[chess.ROOK][rook_from]
+
+        # castling rights are lost when the king or the rook moves or the rook is captured
+        castling_rights = self.castling_rights
+        if castling_rights:
+            touched = from_bb | to_bb
+            if piece_type == chess.KING:
+                touched |= chess.BB_RANK_1 if color == chess.WHITE else chess.BB_RANK_8
+
+            if castling_rights & touched:
+                self.castling_rights = castling_rights & ~touched
+                zobrist ^= castling_zobrist[castling_rights] ^ castling_zobrist[self.castling_rights]
+
+        # the en passant file is only hashed if a pawn is ready to capture en passant
+        zobrist_ep = 0
+        if ep_square is not None and chess.BB_PAWN_ATTACKS[color][ep_square] & self.pieces[opponent][chess.PAWN]:
+            zobrist_ep = zobrist_ep_keys[ep_square]
+
+        self.occupied = occupied_co[0] | occupied_co[1]
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        if color == chess.BLACK:
+            self.fullmove_number += 1
+        self.zobrist = zobrist ^ zobrist_ep
+        self._zobrist_ep = zobrist_ep
+        self.turn = opponent
+
+    # unmake the last move and restore the hash and scores from before it was made
+    def pop(self):
+        move = self.move_stack.pop()
+
+        (captured, self.castling_rights, ep_square, self.halfmove_clock, self.zobrist, self._zobrist_ep,
+         self.material_score, self.middle_game_score, self.end_game_score, self.piece_count) = self._undo_stack.pop()
+
+        from_square = move.from_square
+        to_square = move.to_square
+
+        opponent = self.turn
+        color = not opponent
+        piece_types = self.piece_types
+        new_type = piece_types[to_square]
+        piece_type = chess.PAWN if move.promotion else new_type
+
+        from_bb = chess.BB_SQUARES[from_square]
+        to_bb = chess.BB_SQUARES[to_square]
+        pieces = self.pieces[color]
+        occupied_co = self.occupied_co
+
+        pieces[new_type] ^= to_bb
+        pieces[piece_type] ^= from_bb
+        occupied_co[color] ^= from_bb | to_bb
+        piece_types[from_square] = piece_type
+        piece_types[to_square] = captured
+
+        if captured:
+            self.pieces[opponent][captured] ^= to_bb
+            occupied_co[opponent] ^= to_bb
+        elif piece_type == chess.PAWN and to_square == ep_square:
+            capture_square = to_square - 8 if color == chess.WHITE else to_square + 8
+            capture_bb = chess.BB_SQUARES[capture_square]
+            self.pieces[opponent][chess.PAWN] ^= capture_bb
+            occupied_co[opponent] ^= capture_bb
+            piece_types[capture_square] = chess.PAWN
+        elif piece_type == chess.KING and to_square - from_square in (2, -2):
+            rook_from, rook_to = castling_rook_moves[to_square]
+            rook_bb = chess.BB_SQUARES[rook_from] | chess.BB_SQUARES[rook_to]
+            pieces[chess.ROOK] ^= rook_bb
+            occupied_co[color] ^= rook_bb
+            piece_types[rook_from] = chess.ROOK
+            piece_types[rook_to] = 0
+
+        self.occupied = occupied_co[0] | occupied_co[1]
+        self.ep_square = ep_square
+        if color == chess.BLACK:
+            self.fullmove_number -= 1
+        self.turn = color
+
+        return move
+
+    # calculates the score of a given side
+    def calculate_score(self, side_color):
+        # scores are kept from white's point of view
+        if self._incremental:
+            score = self.material_score
+        else:
+            score = self.bitboard_material_score()
+
+        if side_color == chess.WHITE:
+            return score
+
+        return -score
+
+    def calculate_advanced_score(self, side_color):
+        # use the middle game tables while there are more than 10 pieces on the board, otherwise the end game tables
+        if self.num_pieces > 10:
+            if self._incremental:
+                score = self.middle_game_score
+            else:
+                score = self.bitboard_table_score(middle_game_table)
+        else:
+            if self._incremental:
+                score = self.end_game_score
+            else:
+                score = self.bitboard_table_score(end_game_table)
+
+        # scores are kept from white's point of view
+        if side_color == chess.WHITE:
+            return score
+
+        return -score
+
+    # counts the number of pieces on the board
+    def count_pieces(self):
+        if self._incremental:
+            self.num_pieces = self.piece_count
+        else:
+            self.num_pieces = chess.popcount(self.occupied)
+
+        return self.num_pieces
+
+    # calculate the material score from white's point of view using a popcount of each piece bitboard
+    def bitboard_material_score(self):
+        score = 0
+
+        for color in chess.COLORS:
+            values = material_table[color]
+
+            for piece_type in chess.PIECE_TYPES:
+                score += values[piece_type] * chess.popcount(self.pieces[color][piece_type])
+
+        return score
+
+    # calculate a piece-square score from white's point of view by looking up only the occupied squares of each piece
+    # bitboard in the given score table
+    def bitboard_table_score(self, table):
+        score = 0
+
+        for color in chess.COLORS:
+            for piece_type in chess.PIECE_TYPES:
+                values = table[color][piece_type]
+
+                for square in chess.scan_reversed(self.pieces[color][piece_type]):
+                    score += values[square]
+
+        return score
+
+
+# count the leaf positions of the legal move tree of a search board to a given depth, used to check the search board's
+# move generation against python-chess
+def perft(board, depth):
+    if depth == 0:
+        return 1
+
+    moves = []
+    board.add_pseudo_legal_moves(moves)
+
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        if not board.was_into_check():
+            nodes += perft(board, depth - 1)
+        board.pop()
+
+    return nodes
+
+
+# <> transposition table <>
+# the kinds of score stored in the transposition table
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# the index of each value in a transposition table entry
+TT_KEY = 0
+TT_DEPTH = 1
+TT_SCORE = 2
+TT_BOUND = 3
+TT_MOVE = 4
+TT_GENERATION = 5
+
+# mixed into the key of positions scored with the end game tables
+end_game_key = 0x5A3C9E1F7B2D4C68
+
+
+# a fixed size table of search results keyed by the zobrist hash of a position
+class TranspositionTable:
+    # the approximate memory used by one entry (the list slot, the entry tuple and the key and score it holds)
+    ENTRY_SIZE = 160
+
+    def __init__(self, size_mb=16):
+        # the number of entries the table can hold
+        self.size = max(1, int(size_mb * 1024 * 1024) // self.ENTRY_SIZE)
+
+        # entries are tuples of (key, depth, score, bound, best move, generation)
+        self.entries = [None] * self.size
+
+        # the search the table is being used by, entries from older searches are replaced first
+        self.generation = 0
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.replacements = 0
+        self.rejections = 0
+        self.used = 0
+
+    # mark the start of a new search
+    def new_search(self):
+        self.generation += 1
+
+    # get the entry for a position, returns None if the position is not in the table
+    def probe(self, key):
+        entry = self.entries[key % self.size]
+
+        if entry is not None and entry[TT_KEY] == key:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    # store the result of searching a position
+    def store(self, key, depth, score, bound, move):
+        index = key % self.size
+        entry = self.entries[index]
+
+        if entry is None:
+            self.used += 1
+        elif entry[TT_KEY] != key:
+            # keep an entry for another position if it is from the current search and was searched deeper
+            if entry[TT_GENERATION] == self.generation and entry[TT_DEPTH] > depth:
+                self.rejections += 1
+                return
+
+            self.replacements += 1
+
+        self.entries[index] = (key, depth, score, bound, move, self.generation)
+        self.stores += 1
+
+    # remove every entry from the table
+    def clear(self):
+        self.entries = [None] * self.size
+        self.used = 0
+
+    # returns the table's statistics as a dict
+    def stats(self):
+        probes = self.hits + self.misses
+
+        return {
+            "size": self.size,
+            "used": self.used,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / probes if probes else 0.0,
+            "stores": self.stores,
+            "replacements": self.replacements,
+            "rejections": self.rejections
+        }
+
+
+# <> move ordering <>
+# the value of each piece type used to order captures, indexed by piece type
+ordering_piece_values = [0, 1, 3, 3, 5, 9, 20]
+
+# the ordering score of each kind of move, captures and promotions are also ordered by the pieces involved and quiet
+# moves by their history score (which is capped below the killer move score)
+TT_MOVE_ORDER = 3000000
+CAPTURE_ORDER = 2000000
+KILLER_ORDER = 1000000
+HISTORY_LIMIT = KILLER_ORDER - 1
+
+
+# orders the moves of a position so that the moves most likely to cause an alpha-beta cutoff are searched first:
+# the transposition table move, then captures by most valuable victim / least valuable attacker (MVV-LVA), then the
+# killer moves of the ply (quiet moves which caused a cutoff in a sibling position) and then the remaining quiet moves
+# by how often they have caused cutoffs in the search so far (the history heuristic)
+class MoveOrderer:
+    def __init__(self, max_ply=64):
+        # the two most recent killer moves of each ply
+        self.killers = [[None, None] for _ in range(max_ply)]
+
+        # the history score of each move for each color, indexed by [color][from_square * 64 + to_square]
+        self.history = [[0] * 4096, [0] * 4096]
+
+    # prepare for a new search, the killer moves are specific to a position while the history is only aged
+    def new_search(self):
+        for killers in self.killers:
+            killers[0] = None
+            killers[1] = None
+
+        for history in self.history:
+            for index in range(4096):
+                history[index] >>= 1
+
+    # returns the moves in the order they should be searched
+    def order(self, board, moves, ply, tt_move=None):
+        if ply < len(self.killers):
+            killers = self.killers[ply]
+        else:
+            killers = (None, None)
+        history = self.history[board.turn]
+
+        scores = {}
+        for move in moves:
+            if move == tt_move:
+                scores[move] = TT_MOVE_ORDER
+            elif board.is_capture(move) or move.promotion:
+                scores[move] = CAPTURE_ORDER + self.capture_score(board, move)
+            elif move == killers[0] or move == killers[1]:
+                scores[move] = KILLER_ORDER
+            else:
+                scores[move] = history[move.from_square * 64 + move.to_square]
+
+        # the moves are sorted in place (so that the search can reuse its move lists), sorting is stable so moves with
+        # the same score stay in the order they were generated
+        moves.sort(key=scores.__getitem__, reverse=True)
+        return moves
+
+    # the MVV-LVA score of a capture (or promotion), the most valuable victim first and then the least valuable attacker
+    def capture_score(self, board, move):
+        victim = board.piece_type_at(move.to_square)
+
+        # en passant captures a pawn which is not on the destination square
+        if victim is None and board.is_en_passant(move):
+            victim = chess.PAWN
+
+        score = ordering_piece_values[victim or 0] * 100 - ordering_piece_values[board.piece_type_at(move.from_square)]
+
+        if move.promotion:
+            score += ordering_piece_values[move.promotion] * 100
+
+        return score
+
+    # record a move which caused a cutoff, should be called with the board at the position the move was made from
+    def add_cutoff(self, board, move, ply, depth):
+        # captures are already ordered first so only quiet moves are recorded
+        if board.is_capture(move) or move.promotion:
+            return
+
+        if ply < len(self.killers):
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+
+        # deeper cutoffs save more work so they count for more
+        history = self.history[board.turn]
+        index = move.from_square * 64 + move.to_square
+        history[index] = min(history[index] + depth * depth, HISTORY_LIMIT)
+
+
+# <> quiescence search <>
+# the most plies the quiescence search goes past the end of the main search
+QUIESCENCE_DEPTH = 8
+
+# the most a capture can move the score past the basic value of the captured piece (the difference in advanced piece
+# values and the piece-square changes), captures which could not reach the window even with this margin are pruned by
+# delta pruning, as the margin is never exceeded the pruning does not change the result of the search
+DELTA_MARGIN = 30
+
+
+# the most a capture can change the material score, the value of the captured piece
+def capture_gain(board, move):
+    if board.is_en_passant(move):
+        return piece_score(chess.PAWN)
+
+    victim = board.piece_type_at(move.to_square)
+    if victim is None:
+        return 0
+
+    return piece_score(victim)
+
+
+# <> shared search cache <>
+# the index of each value in a search cache entry
+CACHE_SCORE = 0
+CACHE_MOVE = 1
+CACHE_DEPTH = 2
+
+# the number of positions each shared search cache holds
+SHARED_CACHE_ENTRIES = 100000
+
+# how often (in seconds) a search waiting for another search of the same position checks if it has been cancelled, and
+# the longest it waits before searching the position itself when it has no time limit
+CACHE_WAIT_POLL_INTERVAL = 0.05
+CACHE_MAX_WAIT = 30.0
+
+
+# a thread safe cache of search results (score, best move, depth) keyed by position, when full the least recently used
+# position is removed
+class SearchCache:
+    def __init__(self, max_entries=SHARED_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        # the positions being searched, keyed by position with an event which is set when the search is finished
+        self.pending = {}
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # get the (score, best move, depth) of a position, returns None if the position is not in the cache
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    # get the result for a position or claim the position to search it, if another thread is already searching the
+    # position this waits for its result (for at most max_wait seconds, raising SearchCancelled if cancel_token is
+    # cancelled) so that the position is only searched once, returns (the result or None, whether the position has been
+    # claimed), finish() must be called once the search of a claimed position is done
+    def get_or_claim(self, key, cancel_token=None, max_wait=CACHE_MAX_WAIT):
+        give_up = time.monotonic() + max_wait
+
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry, False
+
+                # nobody is searching the position (or the search which was failed), claim it
+                event = self.pending.get(key)
+                if event is None:
+                    self.pending[key] = threading.Event()
+                    self.misses += 1
+                    return None, True
+
+            if event.wait(CACHE_WAIT_POLL_INTERVAL):
+                continue
+
+            if cancel_token is not None and cancel_token.is_cancelled():
+                raise SearchCancelled()
+
+            # the other search is taking too long, search the position without a claim
+            if time.monotonic() >= give_up:
+                with self.lock:
+                    self.misses += 1
+
+                return None, False
+
+    # release a claim on a position, must only be called by the search which claimed it
+    def finish(self, key):
+        with self.lock:
+            event = self.pending.pop(key, None)
+
+        if event is not None:
+            event.set()
+
+    # store the result of a search, a deeper result already in the cache is kept
+    def put(self, key, score, move, depth):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[CACHE_DEPTH] > depth:
+                self.entries.move_to_end(key)
+                return
+
+            self.entries[key] = (score, move, depth)
+            self.entries.move_to_end(key)
+
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # returns the cache's statistics as a dict
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+
+# the shared search caches of the process, keyed by name
+shared_caches = {}
+shared_caches_lock = threading.Lock()
+
+
+# get the shared search cache with a given name, creating it if it does not exist
+def get_shared_cache(name):
+    with shared_caches_lock:
+        if name not in shared_caches:
+            shared_caches[name] = SearchCache()
+
+        return shared_caches[name]
+
+
+# returns the statistics of every shared search cache in the process, keyed by name
+def shared_cache_stats():
+    with shared_caches_lock:
+        caches = list(shared_caches.items())
+
+    return {name: cache.stats() for name, cache in caches}
+
+
+# raised inside a search when it has run out of time or nodes
+class SearchAborted(Exception):
+    pass
+
+
+# raised inside a search when it has been cancelled, the search is stopped without a move
+class SearchCancelled(SearchAborted):
+    pass
+
+
+# passed to ChessAI.get_move so that the search can be stopped from another thread
+class CancellationToken:
+    def __init__(self):
+        self.event = threading.Event()
+
+    # stop the search the token was passed to
+    def cancel(self):
+        self.event.set()
+
+    # check if the token has been cancelled
+    def is_cancelled(self):
+        return self.event.is_set()
+
+
+# statistics of an AI's search for a move, engine is the name of the AI's type, elapsed is in seconds and depth is the
+# depth of the deepest completed iteration (None for AIs which do not search to a depth)
+class SearchStats:
+    def __init__(self, engine, elapsed=0.0, nodes=0, leaf_evals=0, beta_cutoffs=0, first_move_cutoffs=0, tt_probes=0,
+                 tt_hits=0, tt_cutoffs=0, depth=None, book_move=False, cache_hit=False):
+        self.engine = engine
+        self.elapsed = elapsed
+
+        # the positions visited and the positions scored by the evaluation
+        self.nodes = nodes
+        self.leaf_evals = leaf_evals
+
+        # the searches of a position stopped by a move scoring outside of the window, and how many of them were stopped
+        # by the first move searched (a measure of how good the move ordering is)
+        self.beta_cutoffs = beta_cutoffs
+        self.first_move_cutoffs = first_move_cutoffs
+
+        # the transposition table lookups, the lookups which found the position and the lookups whose stored score was
+        # used instead of searching the position
+        self.tt_probes = tt_probes
+        self.tt_hits = tt_hits
+        self.tt_cutoffs = tt_cutoffs
+
+        self.depth = depth
+
+        # whether the move came from the opening book or the shared search cache rather than a search
+        self.book_move = book_move
+        self.cache_hit = cache_hit
+
+    # return the statistics as a dict
+    def data(self):
+        return {
+            "engine": self.engine,
+            "elapsed": self.elapsed,
+            "nodes": self.nodes,
+            "nodes_per_second": self.nodes / self.elapsed if self.elapsed else 0.0,
+            "leaf_evals": self.leaf_evals,
+            "beta_cutoffs": self.beta_cutoffs,
+            "first_move_cutoffs": self.first_move_cutoffs,
+            "first_move_cutoff_rate": self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0,
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "tt_hit_rate": self.tt_hits / self.tt_probes if self.tt_probes else 0.0,
+            "tt_cutoffs": self.tt_cutoffs,
+            "depth": self.depth,
+            "book_move": self.book_move,
+            "cache_hit": self.cache_hit
+        }
+
+
 class ChessAI:
-    def __init__(self, color=None):
-        # the board used for calculating AI moves
-        self.board = AIBoard()
+    # the type of board the AI calculates its moves on
+    board_type = AIBoard
+
+    def __init__(self, color=None, evaluation="incremental", book=None):
+        # the board used for calculating AI moves, evaluation is the name of the board's evaluation backend (see
+        # EVALUATION_BACKENDS)
+        self.board = self.board_type(evaluation=evaluation)
+
+        # the opening book played from before searching, book is the path of a polyglot book (see opening_book.py)
+        if book is not None:
+            self.book = opening_book.get_book(book)
+        else:
+            self.book = None
+
+        # the cancellation token of the current search
+        self.cancel_token = None
+
+        # whether the board's move stack is the moves of a game from the starting position (so the board can follow
+        # the game move by move) and the number of moves on the stack at the root of the current search
+        self.following_game = True
+        self.root_ply = 0
+
+        # the statistics of the AI's last move (a SearchStats)
+        self.last_stats = None
 
         # set the AI's color
         if color == "w":
@@ -287,30 +1590,127 @@ class ChessAI:
         elif color == "b":
             self.color = chess.BLACK
 
-    # get the AI's move from a given fen
-    def get_move(self, fen):
+    # get the AI's move from a given fen, playing from the opening book if the position is in it, returns None if the
+    # search is cancelled through cancel_token (a CancellationToken), moves is the list of moves of the game from the
+    # starting position if it is known (see sync_board), the statistics of the search are left in last_stats
+    def get_move(self, fen, cancel_token=None, moves=None):
+        start = time.perf_counter()
+
+        self.sync_board(fen, moves)
+        self.cancel_token = cancel_token
+
+        if self.book is not None:
+            move = self.book.probe(self.board)
+
+            if move is not None:
+                self.last_stats = SearchStats(type(self).__name__, time.perf_counter() - start, book_move=True)
+                return move
+
+        try:
+            return self.find_move()
+        except SearchCancelled:
+            return None
+        finally:
+            self.cancel_token = None
+            self.last_stats = self.search_stats(time.perf_counter() - start)
+
+    # bring the board to the position of a game, when the game's moves are given the board only unmakes the moves it
+    # has made which are not part of the game (the moves of the AI's last game or an unfinished search) and makes the
+    # game's moves it has not made yet, otherwise the board is set up from the fen and no longer follows a game (as it
+    # also is when the game's moves do not lead to the fen, such as a game which did not start from the starting
+    # position)
+    def sync_board(self, fen, moves=None):
+        if moves is not None and not self.follow_game(fen, moves):
+            moves = None
+
+        if moves is None:
+            self.board.set_fen(fen)
+            self.following_game = False
+
+        self.root_ply = len(self.board.move_stack)
+
+    # bring the board to the position of a game by making the game's moves from the starting position, returns whether
+    # the moves lead to the game's fen
+    def follow_game(self, fen, moves):
+        if not self.following_game:
+            self.board.set_fen(chess.STARTING_FEN)
+            self.following_game = True
+
+        # the number of moves the board and the game have in common
+        stack = self.board.move_stack
+        common = 0
+        limit = min(len(stack), len(moves))
+        while common < limit and stack[common] == moves[common]:
+            common += 1
+
+        while len(stack) > common:
+            self.board.pop()
+
+        try:
+            for move in moves[common:]:
+                self.board.push(move)
+        except Exception:
+            return False
+
+        return self.board.fen() == fen
+
+    # unmake the moves made on the board since the root of the search
+    def return_to_root(self):
+        while len(self.board.move_stack) > self.root_ply:
+            self.board.pop()
+
+    # check if the current search has been cancelled
+    def is_cancelled(self):
+        return self.cancel_token is not None and self.cancel_token.is_cancelled()
+
+    # find the AI's move for the position on the board, overwritten by each AI
+    def find_move(self):
         return
 
+    # the statistics of the last call to find_move, overwritten by AIs which keep count of their search
+    def search_stats(self, elapsed):
+        return SearchStats(type(self).__name__, elapsed)
+
+
+# the base of the AIs which only look one move ahead, each candidate move they look at is counted as a node (and as a
+# leaf evaluation if the position after it is scored) so that their statistics can be compared with the searching AIs
+class OnePlyAI(ChessAI):
+    def __init__(self, color=None, evaluation="incremental", book=None):
+        super().__init__(color, evaluation, book)
+
+        # the candidate moves looked at and scored by the last move
+        self.nodes = 0
+        self.leaf_evals = 0
+
+    # the statistics of the last call to find_move
+    def search_stats(self, elapsed):
+        return SearchStats(type(self).__name__, elapsed, self.nodes, self.leaf_evals, depth=1)
+
 
 # ai that returns a random move
-class RandomAI(ChessAI):
-    def __init__(self, color=None):
-        super().__init__(color)
+class RandomAI(OnePlyAI):
+    def __init__(self, color=None, evaluation="incremental", book=None):
+        super().__init__(color, evaluation, book)
+
+    # find the AI's move for the position on the board, the only candidate is the move picked
+    def find_move(self):
+        move = self.board.random_move()
 
-    def get_move(self, fen):
-        self.board.set_fen(fen)
+        self.nodes = 1 if move is not None else 0
+        self.leaf_evals = 0
 
-        return self.board.random_move()
+        return move
 
 
 # ai will choose the move that will result in it having the highest point value
-class PointAI(ChessAI):
-    def __init__(self, color=None):
-        super().__init__(color)
+class PointAI(OnePlyAI):
+    def __init__(self, color=None, evaluation="incremental", book=None):
+        super().__init__(color, evaluation, book)
 
-    # get the AI's move from a given fen
-    def get_move(self, fen):
-        self.board.set_fen(fen)
+    # find the AI's move for the position on the board
+    def find_move(self):
+        self.nodes = 0
+        self.leaf_evals = 0
 
         # keeps track of the move that results in the highest score for the AI and what that score is
         best_move = None
@@ -324,13 +1724,18 @@ class PointAI(ChessAI):
         for move in self.board.legal_moves:
             # make the move
             self.board.push(move)
+            self.nodes += 1
+            self.leaf_evals += 1
+
+            # the resulting score of the current move
+            score = self.board.calculate_score(self.color)
 
             # if the resulting score of the current move is higher than the best resulting score found so fare set it as
             # the new best move and score
-            if self.board.calculate_score(self.color) > best_score:
+            if score > best_score:
                 best_move = move
-                best_score = self.board.calculate_score(self.color)
-            elif self.board.calculate_score(self.color) == neutral_score:
+                best_score = score
+            elif score == neutral_score:
                 neutral_moves.append(move)
 
             # undo the move
@@ -347,13 +1752,14 @@ class PointAI(ChessAI):
 
 
 # ai will choose the move that will result in it having the highest point value (using advanced point calcs)
-class AdvancedPointAI(ChessAI):
-    def __init__(self, color=None):
-        super().__init__(color)
+class AdvancedPointAI(OnePlyAI):
+    def __init__(self, color=None, evaluation="incremental", book=None):
+        super().__init__(color, evaluation, book)
 
-    # get the AI's move from a given fen
-    def get_move(self, fen):
-        self.board.set_fen(fen)
+    # find the AI's move for the position on the board
+    def find_move(self):
+        self.nodes = 0
+        self.leaf_evals = 0
 
         # keeps track of the move that results in the highest score for the AI and what that score is
         best_move = None
@@ -367,12 +1773,17 @@ class AdvancedPointAI(ChessAI):
         for move in self.board.legal_moves:
             # make the move
             self.board.push(move)
+            self.nodes += 1
+            self.leaf_evals += 1
+
+            # the resulting score of the current move
+            score = self.board.calculate_advanced_score(self.color)
 
             # if the resulting score of the current move is higher than the best resulting score found so fare set it as
             # the new best move and score
-            if self.board.calculate_advanced_score(self.color) > best_score:
+            if score > best_score:
                 best_move = move
-                best_score = self.board.calculate_advanced_score(self.color)
+                best_score = score
             elif self.board.calculate_score(self.color) == neutral_score:
                 neutral_moves.append(move)
 
@@ -391,33 +1802,177 @@ class AdvancedPointAI(ChessAI):
 
 # minmax AI using basic scoring
 class MiniMaxAI(ChessAI):
-    def __init__(self, color=None):
-        super().__init__(color)
+    # searches make and unmake moves on the lightweight search board
+    board_type = SearchBoard
+
+    def __init__(self, color=None, evaluation="incremental", depth=2, tt_size=16, time_limit=None, node_limit=None,
+                 quiescence=True, quiescence_checks=False, workers=0, book=None, shared_cache=False):
+        super().__init__(color, evaluation, book)
+
+        # the depth searched below each of the AI's moves, when a time or node limit is set this is the deepest
+        # iteration of the iterative deepening search
+        self.depth = depth
+
+        # the budget for each move, time_limit is in seconds
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+
+        # the transposition table is kept for the life of the AI so that the positions searched for one move are
+        # reused when searching the next move of the same game, tt_size is its size in MB
+        self.tt_size = tt_size
+        self.tt = TranspositionTable(tt_size)
+
+        # orders the moves searched at each position
+        self.orderer = MoveOrderer()
+
+        # whether positions at the end of the search are searched further until there are no captures left (and
+        # whether the first ply of that search also includes checks)
+        self.quiescence = quiescence
+        self.quiescence_checks = quiescence_checks
+
+        # the number of worker processes the AI's moves are split across, 0 to search in this process
+        self.workers = workers
+
+        # the number of positions visited by the last search and the depth of the deepest completed iteration
+        self.nodes = 0
+        self.depth_reached = 0
+
+        # the counts kept of the last search for its statistics (see SearchStats)
+        self.reset_counters()
+
+        # the score of the best move of the last search
+        self.best_score = None
+
+        # the move list of each ply of the search, reused by every position searched at the ply
+        self.move_buffers = []
+
+        # when the search budget is next checked, whether it is being enforced and when the search runs out of time
+        self._next_budget_check = float("inf")
+        self._budget_active = False
+        self._deadline = None
+
+        # the cache of search results shared by every AI of the same type and settings in the process
+        if shared_cache:
+            self.cache = get_shared_cache(self.cache_name())
+        else:
+            self.cache = None
+
+    # allow a change in the AI's color
+    def change_color(self, color=None):
+        super().change_color(color)
+
+        # stored scores are from the AI's point of view so they are no longer valid
+        self.tt.clear()
+
+    # find the AI's move for the position on the board, using the result of an earlier search of the position by an AI
+    # of the same type if there is one in the shared cache
+    def find_move(self):
+        key = self.board.zobrist
+        self.reset_counters()
+
+        if self.cache is None:
+            return self.search()
+
+        # the move's time limit covers both waiting for another search of the position and the AI's own search if the
+        # other search gives no result, so the search only gets the time left after the wait
+        if self.time_limit is not None:
+            deadline = time.monotonic() + self.time_limit
+            max_wait = self.time_limit
+        else:
+            deadline = None
+            max_wait = CACHE_MAX_WAIT
+
+        entry, claimed = self.cache.get_or_claim(key, self.cancel_token, max_wait)
+        if entry is not None and self.board.is_legal(entry[CACHE_MOVE]):
+            self.cache_hit = True
+            self.depth_reached = entry[CACHE_DEPTH]
+            self.best_score = entry[CACHE_SCORE]
+            return entry[CACHE_MOVE]
+
+        try:
+            if deadline is not None:
+                move = self.search(max(0.0, deadline - time.monotonic()))
+            else:
+                move = self.search()
+
+            if move is not None:
+                self.cache.put(key, self.best_score, move, self.depth_reached)
+        finally:
+            if claimed:
+                self.cache.finish(key)
+
+        return move
+
+    # search the position on the board for the AI's best move, time_limit is the time the search has (the AI's time
+    # limit if it is not given)
+    def search(self, time_limit=None):
+        if time_limit is None:
+            time_limit = self.time_limit
+
+        # start a new search
+        self.tt.new_search()
+        self.orderer.new_search()
+
+        # the budget is only enforced once there is a move to return but a cancelled search is stopped straight away
+        self._budget_active = False
+        if self.cancel_token is not None:
+            self._next_budget_check = 0
+        else:
+            self._next_budget_check = float("inf")
 
-    # get the AI's move from a given fen
-    def get_move(self, fen):
-        self.board.set_fen(fen)
+        # without a budget search straight to the full depth
+        if time_limit is None and self.node_limit is None:
+            self.depth_reached = self.depth
+            return self.search_root(self.depth)
 
+        if time_limit is not None:
+            self._deadline = time.monotonic() + time_limit
+        else:
+            self._deadline = None
+
+        # the first iteration is always completed so there is a move to return
+        best_move = self.search_root(0)
+        self.depth_reached = 0
+
+        # search one ply deeper each iteration until the budget runs out, each iteration searches the best moves of
+        # the previous one first through the transposition table
+        self._budget_active = True
+        self._next_budget_check = self.nodes
+        for depth in range(1, self.depth + 1):
+            try:
+                move = self.search_root(depth)
+            except SearchCancelled:
+                raise
+            except SearchAborted:
+                # undo the moves of the unfinished iteration
+                self.return_to_root()
+                break
+
+            best_move = move
+            self.depth_reached = depth
+
+        return best_move
+
+    # search each of the AI's moves to a given depth and return the best one
+    def search_root(self, depth):
         # keeps track of the move that results in the highest score for the AI and what that score is
         best_move = None
         best_score = -9999
 
         # keeps track of neutral moves, if the AI's best score is the same as it's current then choose from the neutral
         # move pool
-        neutral_score = self.board.calculate_score(self.color)
+        neutral_score = self.evaluate()
         neutral_moves = []
 
-        # find the best of the legal moves
-        for move in self.board.legal_moves:
-            # make the move
-            self.board.push(move)
-
-            # calculate the score
-            score = self.minmax(2, -10000, 10000, False)
-
-            # undo the move
-            self.board.pop()
+        # score each of the legal moves, split across the worker processes if there are any
+        moves = self.board.valid_moves()
+        if self.workers and depth > 0:
+            scores = self.parallel_root_scores(moves, depth)
+        else:
+            scores = [self.root_move_score(move, depth) for move in moves]
 
+        # find the best of the legal moves
+        for move, score in zip(moves, scores):
             # if the score is higher than the current best score then set the best move and best_score
             if best_score <= score:
                 best_move = move
@@ -432,232 +1987,720 @@ class MiniMaxAI(ChessAI):
             except IndexError:
                 best_move = self.board.random_move()
 
+        self.best_score = best_score
+
         return best_move
 
-    # minmax search algorithm using alpha-beta pruning
-    def minmax(self, depth, alpha, beta, is_maximizing):
-        # if the depth is zero then calculate the point value of the position
-        if depth == 0:
-            score = self.board.calculate_score(self.color)
+    # search one of the AI's moves to a given depth and return its score
+    def root_move_score(self, move, depth):
+        # make the move
+        self.board.push(move)
 
-            return score
+        # count pieces (used by the advanced scoring to choose between the middle and end game tables)
+        self.board.count_pieces()
 
-        # list of valid moves
-        valid_moves = self.board.valid_moves()
+        # calculate the score
+        score = self.minmax(depth, -10000, 10000, False)
+
+        # undo the move
+        self.board.pop()
+
+        return score
+
+    # score the AI's moves in the worker processes, each move is searched with the full window exactly as
+    # root_move_score() would so the scores are the same as a serial search
+    def parallel_root_scores(self, moves, depth):
+        pool = get_search_pool(self.workers)
+        fen = self.board.fen()
+
+        # the node limit is shared out as what is left of it when the moves are handed out
+        if self.node_limit is not None:
+            node_limit = max(1, self.node_limit - self.nodes)
+        else:
+            node_limit = None
+
+        futures = [pool.submit(search_root_move, type(self), self.settings(), self.color, fen, move, depth,
+                               self._deadline, node_limit) for move in moves]
+
+        scores = []
+        try:
+            for future in futures:
+                score, counters = future.result()
+
+                scores.append(score)
+                self.add_counters(counters)
+
+                # the workers can not see the cancellation token so it is checked as each move comes back
+                if self.is_cancelled():
+                    raise SearchCancelled()
+        except SearchAborted:
+            # the iteration will be thrown away so stop any moves which have not been started
+            for future in futures:
+                future.cancel()
+            raise
+
+        return scores
+
+    # the settings the AI was created with, used to create the same AI in a worker process
+    def settings(self):
+        return {
+            "evaluation": self.board.evaluation,
+            "depth": self.depth,
+            "tt_size": self.tt_size,
+            "quiescence": self.quiescence,
+            "quiescence_checks": self.quiescence_checks
+        }
+
+    # start the counts kept of a search
+    def reset_counters(self):
+        self.nodes = 0
+        self.leaf_evals = 0
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.tt_cutoffs = 0
+        self.cache_hit = False
+
+        # the table keeps its own counts for its whole life so the search's lookups are the change in them
+        self.tt_hits_start = self.tt.hits
+        self.tt_probes_start = self.tt.hits + self.tt.misses
+
+    # the counts kept of the search, (nodes, leaf evaluations, beta cutoffs, first move cutoffs, table cutoffs)
+    def counters(self):
+        return self.nodes, self.leaf_evals, self.beta_cutoffs, self.first_move_cutoffs, self.tt_cutoffs
+
+    # add the counts of part of the search made elsewhere (in a worker process) to the search's counts
+    def add_counters(self, counters):
+        nodes, leaf_evals, beta_cutoffs, first_move_cutoffs, tt_cutoffs = counters
+
+        self.nodes += nodes
+        self.leaf_evals += leaf_evals
+        self.beta_cutoffs += beta_cutoffs
+        self.first_move_cutoffs += first_move_cutoffs
+        self.tt_cutoffs += tt_cutoffs
+
+    # the statistics of the last search
+    def search_stats(self, elapsed):
+        return SearchStats(
+            type(self).__name__, elapsed, self.nodes, self.leaf_evals, self.beta_cutoffs, self.first_move_cutoffs,
+            self.tt.hits + self.tt.misses - self.tt_probes_start, self.tt.hits - self.tt_hits_start, self.tt_cutoffs,
+            self.depth_reached, cache_hit=self.cache_hit
+        )
+
+    # the name of the shared cache used by AIs of this type, AIs only share results if they search the same way
+    def cache_name(self):
+        settings = self.settings()
+        settings["time_limit"] = self.time_limit
+        settings["node_limit"] = self.node_limit
+
+        return type(self).__name__ + repr(sorted(settings.items()))
+
+    # calculate the point value of the position for the AI
+    def evaluate(self):
+        return self.board.calculate_score(self.color)
+
+    # returns the score of a position with no legal moves (checkmate or stalemate), None to score it as a position
+    # whose moves all lose
+    def terminal_score(self):
+        return None
+
+    # the key the position's search results are stored under in the transposition table
+    def search_key(self):
+        return self.board.zobrist
+
+    # raise SearchCancelled if the search has been cancelled or SearchAborted if it has used up its budget, otherwise
+    # schedule the next check
+    def check_budget(self):
+        if self.is_cancelled():
+            raise SearchCancelled()
+
+        if self._budget_active:
+            if self.node_limit is not None and self.nodes >= self.node_limit:
+                raise SearchAborted()
+
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                raise SearchAborted()
+
+        # checking the clock is slow compared to visiting a node so it is only done every so many nodes
+        self._next_budget_check = self.nodes + 256
+        if self.node_limit is not None:
+            self._next_budget_check = min(self._next_budget_check, self.node_limit)
+
+    # minmax search algorithm using alpha-beta pruning, ply is the number of moves made since the root of the search
+    def minmax(self, depth, alpha, beta, is_maximizing, ply=1):
+        self.nodes += 1
+        if self.nodes >= self._next_budget_check:
+            self.check_budget()
+
+        # if the depth is zero then calculate the point value of the position (once any captures have been played out)
+        if depth == 0:
+            if self.quiescence:
+                return self.quiesce(alpha, beta, is_maximizing, ply)
+
+            self.leaf_evals += 1
+            return self.evaluate()
+
+        # check if the position has already been searched to the same depth, a score found at a different depth is not
+        # used so that the result is the same as searching without the table (positions where the game is over are
+        # never stored so they are not found here)
+        key = self.search_key()
+        entry = self.tt.probe(key)
+        if entry is not None and entry[TT_DEPTH] == depth:
+            score = entry[TT_SCORE]
+            bound = entry[TT_BOUND]
+
+            if bound == EXACT or (bound == LOWER_BOUND and score >= beta) or (bound == UPPER_BOUND and score <= alpha):
+                self.tt_cutoffs += 1
+                return score
+
+        # generate the pseudo-legal moves of the position into the ply's move list, moves which leave the king in check
+        # are skipped when they are made
+        if ply >= len(self.move_buffers):
+            self.move_buffers.extend([] for _ in range(ply + 1 - len(self.move_buffers)))
+        valid_moves = self.move_buffers[ply]
+        valid_moves.clear()
+        self.board.add_pseudo_legal_moves(valid_moves)
+
+        # the window the position was searched with, used to tell what kind of score the search found
+        alpha_original = alpha
+        beta_original = beta
+
+        # list of valid moves, ordered so that the best move found by an earlier search of the position is searched
+        # first followed by the other moves most likely to cause a cutoff
+        if entry is not None:
+            tt_move = entry[TT_MOVE]
+        else:
+            tt_move = None
+        valid_moves = self.orderer.order(self.board, valid_moves, ply, tt_move)
+
+        # keep track of the move which gave the best score and the number of legal moves searched
+        best_move = None
+        legal_moves = 0
 
         if is_maximizing:
             # keep track of the best score
             best_score = -9999
 
             for move in valid_moves:
-                # make a move
+                # make a move, skipping it if it is not legal
                 self.board.push(move)
+                if self.board.was_into_check():
+                    self.board.pop()
+                    continue
+                legal_moves += 1
 
-                # check if the calculated score is higher than the current best score
-                best_score = max(best_score, self.minmax(depth - 1, alpha, beta, not is_maximizing))
+                # calculate the score of the move
+                score = self.minmax(depth - 1, alpha, beta, not is_maximizing, ply + 1)
 
                 # reverse the move
                 self.board.pop()
 
-                # alpha beta pruning return
+                # check if the calculated score is higher than the current best score
+                if score > best_score:
+                    best_score = score
+                    best_move = move
+
+                # alpha beta pruning
                 if best_score >= beta:
-                    return best_score
+                    self.orderer.add_cutoff(self.board, move, ply, depth)
+                    self.beta_cutoffs += 1
+                    if legal_moves == 1:
+                        self.first_move_cutoffs += 1
+                    break
 
                 # calculate the new alpha
                 alpha = max(alpha, best_score)
-
-            # fallback return if no pruning occurs
-            return best_score
         else:
             # keep track of the best score
             best_score = 9999
 
             for move in valid_moves:
-                # make a move
+                # make a move, skipping it if it is not legal
                 self.board.push(move)
+                if self.board.was_into_check():
+                    self.board.pop()
+                    continue
+                legal_moves += 1
 
-                # check if the calculated score is higher than the current best score
-                best_score = min(best_score, self.minmax(depth - 1, alpha, beta, not is_maximizing))
+                # calculate the score of the move
+                score = self.minmax(depth - 1, alpha, beta, not is_maximizing, ply + 1)
 
                 # reverse the move
                 self.board.pop()
 
-                # alpha beta pruning return
+                # check if the calculated score is lower than the current best score
+                if score < best_score:
+                    best_score = score
+                    best_move = move
+
+                # alpha beta pruning
                 if best_score <= alpha:
-                    return best_score
+                    self.orderer.add_cutoff(self.board, move, ply, depth)
+                    self.beta_cutoffs += 1
+                    if legal_moves == 1:
+                        self.first_move_cutoffs += 1
+                    break
 
                 # calculate the new beta
                 beta = min(beta, best_score)
 
-            # fallback return if no pruning occurs
+        # stop searching if the game is over
+        if not legal_moves:
+            score = self.terminal_score()
+            if score is not None:
+                return score
+
+        # store the result, a score outside of the window is only a bound on the real score of the position
+        if best_score <= alpha_original:
+            bound = UPPER_BOUND
+        elif best_score >= beta_original:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, best_score, bound, best_move)
+
+        return best_score
+
+    # quiescence search, only captures are searched so that a position is not scored in the middle of an exchange
+    def quiesce(self, alpha, beta, is_maximizing, ply, quiescence_ply=0):
+        self.nodes += 1
+        if self.nodes >= self._next_budget_check:
+            self.check_budget()
+
+        # the score if no capture is made (stand pat), the side to move is never forced to capture
+        self.leaf_evals += 1
+        stand_pat = self.evaluate()
+        best_score = stand_pat
+
+        if quiescence_ply >= QUIESCENCE_DEPTH:
             return best_score
 
+        if is_maximizing:
+            if best_score >= beta:
+                return best_score
 
-# minmax AI using basic scoring
-class AdvancedMiniMaxAI(ChessAI):
-    def __init__(self, color=None):
-        super().__init__(color)
+            alpha = max(alpha, best_score)
+        else:
+            if best_score <= alpha:
+                return best_score
+
+            beta = min(beta, best_score)
+
+        for move in self.quiescence_moves(ply, quiescence_ply):
+            # delta pruning, skip captures which can not bring the score back inside the window even if the captured
+            # piece is won for free, the best score is moved to the most the capture could have scored so that the
+            # score returned is still a true bound
+            if not move.promotion:
+                gain = capture_gain(self.board, move) + DELTA_MARGIN
+
+                if is_maximizing and stand_pat + gain <= alpha:
+                    best_score = max(best_score, stand_pat + gain)
+                    continue
+                if not is_maximizing and stand_pat - gain >= beta:
+                    best_score = min(best_score, stand_pat - gain)
+                    continue
+
+            # make a move, skipping it if it is not legal
+            self.board.push(move)
+            if self.board.was_into_check():
+                self.board.pop()
+                continue
 
-    # get the AI's move from a given fen
-    def get_move(self, fen):
-        self.board.set_fen(fen)
+            # calculate the score of the move
+            score = self.quiesce(alpha, beta, not is_maximizing, ply + 1, quiescence_ply + 1)
 
-        # keeps track of the move that results in the highest score for the AI and what that score is
-        best_move = None
-        best_score = -9999
+            # reverse the move
+            self.board.pop()
 
-        # keeps track of neutral moves, if the AI's best score is the same as it's current then choose from the neutral
-        # move pool
-        neutral_score = self.board.calculate_advanced_score(self.color)
-        neutral_moves = []
+            if is_maximizing:
+                best_score = max(best_score, score)
 
-        # number of valid moves
-        num_pieces = self.board.count_pieces()
+                # alpha beta pruning
+                if best_score >= beta:
+                    break
 
-        # find the best of the legal moves
-        for move in self.board.legal_moves:
-            # make the move
-            self.board.push(move)
+                # calculate the new alpha
+                alpha = max(alpha, best_score)
+            else:
+                best_score = min(best_score, score)
 
-            # # count pieces
-            self.board.count_pieces()
+                # alpha beta pruning
+                if best_score <= alpha:
+                    break
 
-            score = self.minmax(2, -10000, 10000, False)
+                # calculate the new beta
+                beta = min(beta, best_score)
 
-            # undo the move
-            self.board.pop()
+        return best_score
 
-            # if the score is higher than the current best score then set the best move and best_score
-            if best_score <= score:
-                best_move = move
-                best_score = score
-            elif score == neutral_score:
-                neutral_moves.append(move)
+    # the moves searched by the quiescence search, captures by MVV-LVA and optionally checks on its first ply (the
+    # captures are pseudo-legal)
+    def quiescence_moves(self, ply, quiescence_ply):
+        moves = []
+        self.board.add_pseudo_legal_moves(moves, captures_only=True)
 
-        # if no best move was found then choose from one of the neutral moves
-        if best_score == neutral_score:
-            try:
-                best_move = random.choice(neutral_moves)
-            except IndexError:
-                best_move = self.board.random_move()
+        if self.quiescence_checks and quiescence_ply == 0:
+            for move in self.board.generate_legal_moves():
+                if not self.board.is_capture(move) and self.board.gives_check(move):
+                    moves.append(move)
 
-        return best_move
+        return self.orderer.order(self.board, moves, ply)
 
-    # minmax search algorithm using alpha-beta pruning
-    def minmax(self, depth, alpha, beta, is_maximizing):
-        # if the depth is zero then calculate the point value of the position
-        if depth == 0:
-            score = self.board.calculate_advanced_score(self.color)
 
-            return score
+# minmax AI using advanced scoring
+class AdvancedMiniMaxAI(MiniMaxAI):
+    def __init__(self, color=None, evaluation="incremental", depth=2, tt_size=16, time_limit=None, node_limit=None,
+                 quiescence=True, quiescence_checks=False, workers=0, book=None, shared_cache=False):
+        super().__init__(color, evaluation, depth, tt_size, time_limit, node_limit, quiescence, quiescence_checks,
+                         workers, book, shared_cache)
 
-        # if the move results in checkmate GO FOR IT
-        if self.board.is_checkmate() and self.board.turn != self.color:
-            return 1000 + self.board.calculate_advanced_score(self.color)
+    # calculate the point value of the position for the AI using the advanced scoring
+    def evaluate(self):
+        return self.board.calculate_advanced_score(self.color)
 
-        # if the move results in draw DONT GO FOR IT
-        if self.board.is_stalemate() and self.board.turn != self.color:
+    # returns the score of a position with no legal moves (checkmate if in check, otherwise stalemate), None to score
+    # it as a position whose moves all lose
+    def terminal_score(self):
+        if self.board.is_check():
+            # if the move results in checkmate GO FOR IT
+            if self.board.turn != self.color:
+                return 1000 + self.board.calculate_advanced_score(self.color)
+
+            # if the move results in you getting checkmated DONT GO FOR IT
             return -1000 + self.board.calculate_advanced_score(self.color)
 
-        # if the move results in you getting checkmated DONT GO FOR IT
-        if self.board.is_checkmate() and self.board.turn == self.color:
+        # if the move results in draw DONT GO FOR IT
+        if self.board.turn != self.color:
             return -1000 + self.board.calculate_advanced_score(self.color)
 
-        # list of valid moves
-        valid_moves = self.board.valid_moves()
+        return None
 
-        if is_maximizing:
-            # keep track of the best score
-            best_score = -9999
+    # the advanced scoring depends on whether the end game tables are in use so that is part of the key
+    def search_key(self):
+        if self.board.num_pieces > 10:
+            return self.board.zobrist
 
-            for move in valid_moves:
-                # make a move
-                self.board.push(move)
+        return self.board.zobrist ^ end_game_key
 
-                # check if the calculated score is higher than the current best score
-                best_score = max(best_score, self.minmax(depth - 1, alpha, beta, not is_maximizing))
 
-                # reverse the move
-                self.board.pop()
+# <> parallel search <>
+# the worker process pools used by AIs which search in parallel, keyed by their number of workers and shared by every
+# AI with the same number of workers
+search_pools = {}
+search_pools_lock = threading.Lock()
 
-                # alpha beta pruning return
-                if best_score >= beta:
-                    return best_score
+# the AIs created in a worker process, keyed by their type, settings and color, kept so that each search in the worker
+# reuses the AI's board, transposition table and move ordering
+worker_engines = {}
 
-                # calculate the new alpha
-                alpha = max(alpha, best_score)
 
-            # fallback return if no pruning occurs
-            return best_score
+# get the worker process pool with a given number of workers
+def get_search_pool(workers):
+    with search_pools_lock:
+        if workers not in search_pools:
+            search_pools[workers] = ProcessPoolExecutor(max_workers=workers)
+
+        return search_pools[workers]
+
+
+# search one of an AI's moves in a worker process, returns the score of the move and the counts kept of its search (see
+# MiniMaxAI.counters)
+def search_root_move(engine_type, settings, color, fen, move, depth, deadline, node_limit):
+    key = (engine_type, tuple(sorted(settings.items())), color)
+
+    engine = worker_engines.get(key)
+    if engine is None:
+        engine = engine_type(**settings)
+        engine.color = color
+        worker_engines[key] = engine
+
+    # start a new search with the budget of the search the move is part of
+    engine.board.set_fen(fen)
+    engine.reset_counters()
+    engine.tt.new_search()
+    engine.orderer.new_search()
+    engine.node_limit = node_limit
+    engine._deadline = deadline
+    engine._budget_active = True
+    if node_limit is not None or deadline is not None:
+        engine._next_budget_check = 0
+    else:
+        engine._next_budget_check = float("inf")
+
+    score = engine.root_move_score(move, depth)
+
+    return score, engine.counters()
+
+
+# <> monte carlo tree search <>
+# random games are stopped once one side is ahead by this much material (a rook) as the result is then clear enough
+ROLLOUT_MATERIAL_CUTOFF = 50
+
+# how quickly the result of an unfinished random game moves from a draw towards a win as the material difference grows
+ROLLOUT_MATERIAL_SCALE = 20
+
+
+# a position in the monte carlo search tree
+class MonteCarloNode:
+    def __init__(self, board, move=None, parent=None):
+        # the move which led to the position and the position it was made from
+        self.move = move
+        self.parent = parent
+
+        # the zobrist hash of the position, used to find the position again when the tree is reused
+        self.key = board.zobrist
+
+        # the color which made the move into the position, the node's results are from their point of view
+        self.color = not board.turn
+
+        # searched children and the moves which have not been searched yet
+        self.children = []
+        self.untried_moves = board.valid_moves()
+        random.shuffle(self.untried_moves)
+
+        # the number of random games played through the position and the total of their results
+        self.visits = 0
+        self.wins = 0.0
+
+    # pick the child to search using the UCT formula, balancing the child's results against how little it has been
+    # searched
+    def select_child(self, exploration):
+        log_visits = math.log(self.visits)
+
+        best_child = None
+        best_value = -1.0
+
+        for child in self.children:
+            value = child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits)
+
+            if value > best_value:
+                best_child = child
+                best_value = value
+
+        return best_child
+
+    # add a random game result given from white's point of view
+    def update(self, result):
+        self.visits += 1
+
+        if self.color == chess.WHITE:
+            self.wins += result
         else:
-            # keep track of the best score
-            best_score = 9999
+            self.wins += 1.0 - result
 
-            for move in valid_moves:
-                # make a move
-                self.board.push(move)
 
-                # check if the calculated score is higher than the current best score
-                best_score = min(best_score, self.minmax(depth - 1, alpha, beta, not is_maximizing))
+# play random moves on a board until the game ends, max_plies have been played or one side is far enough ahead in
+# material, the board is returned to its starting position and the result is returned from white's point of view
+# (1 for a white win, 0 for a black win)
+def play_random_game(board, max_plies):
+    plies = 0
+    result = None
 
-                # reverse the move
-                self.board.pop()
+    # the list the moves of each ply are generated into, only the move played is checked for legality
+    moves = []
 
-                # alpha beta pruning return
-                if best_score <= alpha:
-                    return best_score
+    while True:
+        move = board.random_move(moves)
 
-                # calculate the new beta
-                beta = min(beta, best_score)
+        # the game is over
+        if move is None:
+            if board.is_check():
+                result = 0.0 if board.turn == chess.WHITE else 1.0
+            else:
+                result = 0.5
+            break
 
-            # fallback return if no pruning occurs
-            return best_score
+        material = board.calculate_score(chess.WHITE)
+        if plies >= max_plies or abs(material) >= ROLLOUT_MATERIAL_CUTOFF:
+            break
+
+        board.push(move)
+        plies += 1
 
+    # score unfinished games by material
+    if result is None:
+        result = 1.0 / (1.0 + math.exp(-board.calculate_score(chess.WHITE) / ROLLOUT_MATERIAL_SCALE))
 
+    for _ in range(plies):
+        board.pop()
+
+    return result
+
+
+# the boards used to play random games in the worker processes, keyed by evaluation backend
+worker_boards = {}
+
+
+# play a random game from a given position in a worker process
+def play_random_game_from(fen, max_plies, evaluation):
+    board = worker_boards.get(evaluation)
+    if board is None:
+        board = SearchBoard(evaluation=evaluation)
+        worker_boards[evaluation] = board
+
+    board.set_fen(fen)
+
+    return play_random_game(board, max_plies)
+
+
+# ai which chooses its moves with a monte carlo tree search (UCT), the tree is kept between moves of the same game
 class MonteCarloAI(ChessAI):
-    def __init__(self, color=None):
-        super().__init__(color)
+    # random games are played on the lightweight search board
+    board_type = SearchBoard
 
-    def get_move(self, fen):
-        self.board.set_fen(fen)
+    def __init__(self, color=None, evaluation="incremental", playouts=500, time_limit=None, rollout_depth=40,
+                 exploration=1.4, workers=0, batch_size=8, book=None):
+        super().__init__(color, evaluation, book)
 
-        best_score = 0
-        best_move = None
-        neutral_moves = []
+        # the number of random games played for each move and the time limit for each move in seconds
+        self.playouts = playouts
+        self.time_limit = time_limit
 
-        # find the best of the legal moves
-        for move in self.board.legal_moves:
-            # make the move
+        # the most moves played in each random game
+        self.rollout_depth = rollout_depth
+
+        # how much the search favours positions which have not been searched much over positions with good results
+        self.exploration = exploration
+
+        # the number of worker processes random games are played in (0 to play them in this process) and the number
+        # of random games handed out to them at a time
+        self.workers = workers
+        self.batch_size = batch_size
+
+        # the root of the search tree
+        self.root = None
+
+        # the number of random games played by the last search
+        self.nodes = 0
+
+    # allow a change in the AI's color
+    def change_color(self, color=None):
+        super().change_color(color)
+
+        self.root = None
+
+    # find the AI's move for the position on the board
+    def find_move(self):
+        # reuse the part of the tree below the current position if there is one
+        self.root = self.find_root()
+        self.nodes = 0
+
+        if not self.root.untried_moves and not self.root.children:
+            return None
+
+        if self.time_limit is not None:
+            deadline = time.monotonic() + self.time_limit
+        else:
+            deadline = None
+
+        # at least one random game is always played so that the root has a move to play, however small the budget
+        while self.nodes < self.playouts or not self.root.children:
+            if deadline is not None and time.monotonic() >= deadline and self.root.children:
+                break
+
+            if self.is_cancelled():
+                raise SearchCancelled()
+
+            if self.workers:
+                self.nodes += self.parallel_playouts(max(1, min(self.batch_size, self.playouts - self.nodes)))
+            else:
+                self.playout()
+                self.nodes += 1
+
+        # play the move which has been searched the most, it is the most reliable
+        best_child = max(self.root.children, key=lambda child: child.visits)
+
+        # keep the tree below the move
+        self.root = best_child
+        self.root.parent = None
+
+        return best_child.move
+
+    # find the node of the current position in the tree left by the last search (either the position after the last
+    # move or a reply to it), starting a new tree if it can not be found
+    def find_root(self):
+        key = self.board.zobrist
+
+        if self.root is not None:
+            if self.root.key == key:
+                return self.root
+
+            for child in self.root.children:
+                if child.key == key:
+                    child.parent = None
+                    return child
+
+        return MonteCarloNode(self.board)
+
+    # walk down the tree to the position to play a random game from, adding a new node if the position has moves
+    # which have not been searched, the board is left at the position
+    def select(self):
+        node = self.root
+
+        while not node.untried_moves and node.children:
+            node = node.select_child(self.exploration)
+            self.board.push(node.move)
+
+        if node.untried_moves:
+            move = node.untried_moves.pop()
             self.board.push(move)
 
-            # score the move
-            score = self.monte_carlo(10)
+            child = MonteCarloNode(self.board, move, node)
+            node.children.append(child)
+            node = child
 
-            # undo the move
-            self.board.pop()
+        return node
 
-            # if the score is higher than the current best score then set the best move and best_score
-            if best_score <= score:
-                best_move = move
-                best_score = score
+    # add the result of a random game to a node and every node above it
+    def backpropagate(self, node, result):
+        while node is not None:
+            node.update(result)
+            node = node.parent
 
-        # if no best move was found then choose from one of the neutral moves
-        if best_score == 0:
-            best_move = self.board.random_move()
+    # play one random game from the next position to search
+    def playout(self):
+        node = self.select()
 
-        return best_move
+        result = play_random_game(self.board, self.rollout_depth)
 
-    # execute a monte carlo search on the board
-    def monte_carlo(self, games):
-        results = 0
+        # return to the root
+        self.return_to_root()
 
-        for x in range(1, games):
-            results += self.play_random_game()
+        self.backpropagate(node, result)
 
-        return results / games
+    # play a batch of random games in the worker processes, returns the number of games played
+    def parallel_playouts(self, batch_size):
+        nodes = []
+        fens = []
 
-    # plays a random game from a given position and returns the result
-    def play_random_game(self):
+        for _ in range(batch_size):
+            node = self.select()
+            fens.append(self.board.fen())
 
+            # count a loss against the path until the result is in (a virtual loss) so that the rest of the batch is
+            # spread over other positions
+            path = node
+            while path is not None:
+                path.visits += 1
+                path = path.parent
 
-        return
+            self.return_to_root()
+
+            nodes.append(node)
+
+        pool = get_search_pool(self.workers)
+        futures = [pool.submit(play_random_game_from, fen, self.rollout_depth, self.board.evaluation) for fen in fens]
+
+        for node, future in zip(nodes, futures):
+            # take back the virtual loss and add the real result
+            path = node
+            while path is not None:
+                path.visits -= 1
+                path = path.parent
+
+            self.backpropagate(node, future.result())
+
+        return batch_size
+
+    # the statistics of the last search, each random game counts as a node
+    def search_stats(self, elapsed):
+        return SearchStats(type(self).__name__, elapsed, self.nodes)
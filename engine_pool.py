@@ -0,0 +1,183 @@
+import threading
+import time
+
+"""
+    Pools of AI engines shared by every game.
+
+    Creating an AI allocates its board, transposition table and move ordering tables, so rather than each game creating
+    (and keeping) its own AI, games hold a PooledAI which checks an AI out of the pool for its type and settings for
+    each move and returns it afterwards. Each pool holds at most a fixed number of AIs, a move waits (for a limited
+    time, or until it is cancelled) for an AI to be returned if they are all in use.
+
+    A game gets back the AI which made its last move whenever that AI is free so that the AI's transposition table and
+    search tree (which are of the game's last position) are kept, otherwise it takes any free AI.
+"""
+
+# how often (in seconds) a move waiting for an AI checks if it has been cancelled, and the longest it waits
+CHECKOUT_POLL_INTERVAL = 0.05
+CHECKOUT_MAX_WAIT = 30.0
+
+# the engine pools, keyed by the type and settings of their AIs
+engine_pools = {}
+engine_pools_lock = threading.Lock()
+
+
+# a bounded pool of AIs of the same type and settings
+class EnginePool:
+    def __init__(self, engine_type, size, settings):
+        self.engine_type = engine_type
+        self.size = size
+        self.settings = settings
+
+        # the AIs which are not checked out, keyed by their color so that an AI keeps its color (changing the color of
+        # a minimax AI clears its transposition table) wherever possible
+        self.free = {"w": [], "b": []}
+
+        # the number of AIs created by the pool
+        self.created = 0
+
+        self.condition = threading.Condition()
+
+    # create AIs until the pool holds count of them (or is full) so that the first moves do not have to create them
+    def warm(self, count, color="w"):
+        with self.condition:
+            while self.created < min(count, self.size):
+                self.free[color].append(self.engine_type(color=color, **self.settings))
+                self.created += 1
+
+    # take a given AI out of the free AIs if it is free, returns the color it was kept under or None if it is not free
+    def take_free(self, engine):
+        for color, free in self.free.items():
+            for i, free_engine in enumerate(free):
+                if free_engine is engine:
+                    del free[i]
+                    return color
+
+        return None
+
+    # check out an AI playing a given color, preferred is the AI to check out if it is free (the AI which made the
+    # game's last move), waits for an AI to be checked in if they are all in use, returns None if the move is cancelled
+    # through cancel_token (a CancellationToken) or no AI is checked in within max_wait seconds
+    def checkout(self, color, preferred=None, cancel_token=None, max_wait=CHECKOUT_MAX_WAIT):
+        other_color = "b" if color == "w" else "w"
+        deadline = time.monotonic() + max_wait
+
+        with self.condition:
+            while True:
+                preferred_color = self.take_free(preferred) if preferred is not None else None
+                if preferred_color is not None:
+                    if preferred_color != color:
+                        preferred.change_color(color)
+                    return preferred
+
+                if self.free[color]:
+                    return self.free[color].pop()
+
+                if self.free[other_color]:
+                    engine = self.free[other_color].pop()
+                    engine.change_color(color)
+                    return engine
+
+                if self.created < self.size:
+                    self.created += 1
+                    break
+
+                if cancel_token is not None and cancel_token.is_cancelled():
+                    return None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+
+                self.condition.wait(min(CHECKOUT_POLL_INTERVAL, remaining))
+
+        # create the AI outside of the lock so that other AIs can be checked in and out in the meantime
+        try:
+            return self.engine_type(color=color, **self.settings)
+        except Exception:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+            raise
+
+    # return an AI to the pool
+    def checkin(self, engine, color):
+        with self.condition:
+            self.free[color].append(engine)
+            self.condition.notify()
+
+    # returns the pool's statistics as a dict
+    def stats(self):
+        with self.condition:
+            free = len(self.free["w"]) + len(self.free["b"])
+
+            return {
+                "size": self.size,
+                "created": self.created,
+                "free": free,
+                "in_use": self.created - free
+            }
+
+
+# get the engine pool for AIs of a given type and settings, creating it (with warm AIs in it) if it does not exist
+def get_engine_pool(engine_type, size, warm=1, **settings):
+    key = (engine_type, tuple(sorted(settings.items())))
+
+    with engine_pools_lock:
+        pool = engine_pools.get(key)
+
+        if pool is None:
+            pool = EnginePool(engine_type, size, settings)
+            engine_pools[key] = pool
+        else:
+            warm = 0
+
+    pool.warm(warm)
+
+    return pool
+
+
+# returns the statistics of every engine pool, keyed by the name of their AI type
+def engine_pool_stats():
+    with engine_pools_lock:
+        pools = list(engine_pools.items())
+
+    return {engine_type.__name__ + repr(settings): pool.stats() for (engine_type, settings), pool in pools}
+
+
+# an AI which checks an AI out of an engine pool for each move
+class PooledAI:
+    def __init__(self, pool, color=None):
+        self.pool = pool
+
+        self.color = "w"
+        self.change_color(color)
+
+        # the AI which made the last move, checked out again for the next move if it is free
+        self.engine = None
+
+        # the statistics of the AI's last move (a chess_ai.SearchStats)
+        self.last_stats = None
+
+    # allow a change in the AI's color
+    def change_color(self, color=None):
+        if color == "w" or color == "b":
+            self.color = color
+
+    # get the AI's move from a given fen (and the moves of the game so far if they are known), returns None if the move
+    # is cancelled through cancel_token (a CancellationToken) or no AI in the pool is free in time
+    def get_move(self, fen, cancel_token=None, moves=None):
+        color = self.color
+        engine = self.pool.checkout(color, self.engine, cancel_token)
+
+        if engine is None:
+            self.last_stats = None
+            return None
+
+        self.engine = engine
+
+        try:
+            return engine.get_move(fen, cancel_token, moves)
+        finally:
+            self.last_stats = engine.last_stats
+            self.pool.checkin(engine, color)
@@ -1,4 +1,7 @@
 import chess
+import chess_ai
+import game_store
+import metrics
 import secrets
 import enum
 import random
@@ -7,6 +10,16 @@ import datetime
 import threading
 
 
+# server metrics (see metrics.py)
+sessions_created = metrics.Counter("chess_sessions_created_total", "Game sessions created.", ["mode"])
+sessions_expired = metrics.Counter("chess_sessions_expired_total", "Game sessions removed after timing out.")
+sessions_deleted = metrics.Counter("chess_sessions_deleted_total", "Game sessions removed when the game ended.")
+ai_move_jobs = metrics.Gauge("chess_ai_move_jobs", "AI move jobs in the executor, by whether they have started.",
+                             ["state"])
+ai_move_wait = metrics.Histogram("chess_ai_move_wait_seconds", "Time AI move jobs wait in the executor queue.")
+ai_move_latency = metrics.Histogram("chess_ai_move_seconds", "Time taken to make an AI move, by AI type.", ["engine"])
+
+
 # definitions for the results of a game
 class GameState(enum.Enum):
     STALEMATE = "stalemate"
@@ -31,7 +44,11 @@ class Player:
         return
 
     # overwritten by AI player type
-    def get_move(self, fen):
+    def get_move(self, fen, cancel_token=None, moves=None):
+        return None
+
+    # overwritten by AI player type
+    def search_stats(self):
         return None
 
     # change the Player's color
@@ -46,6 +63,15 @@ class Player:
             "color": self.color
         }
 
+    # return the player's record as a dict (see GameManager.Game.record)
+    def record(self):
+        return {
+            "type": "player",
+            "name": self.username,
+            "id": self.id,
+            "color": self.color
+        }
+
 
 # AI class for storing AI data in the game manager (also stores the AI engine)
 class AI(Player):
@@ -59,9 +85,14 @@ class AI(Player):
         self.color = color
         return
 
-    # get the ai's next move based on a fen string
-    def get_move(self, fen):
-        return self.ai.get_move(fen=fen)
+    # get the ai's next move based on a fen string and the moves of the game so far (so that the ai can follow the game
+    # move by move rather than setting up the fen), the search can be stopped through cancel_token
+    def get_move(self, fen, cancel_token=None, moves=None):
+        return self.ai.get_move(fen=fen, cancel_token=cancel_token, moves=moves)
+
+    # the statistics of the ai's last move (a chess_ai.SearchStats), None if the ai does not keep them
+    def search_stats(self):
+        return getattr(self.ai, "last_stats", None)
 
     # change the AI's color
     def set_color(self, color):
@@ -77,30 +108,187 @@ class AI(Player):
             "color": self.color
         }
 
+    # return the AI's record as a dict, the id is the name the AI is created from (see GameManager.Game.record)
+    def record(self):
+        return {
+            "type": "ai",
+            "name": self.username,
+            "id": self.id,
+            "color": self.color
+        }
+
 
 # manages all ongoing games within the app
 class GameManager:
     class Game:
+        # a board which keeps count of how many times each position has occurred so that the state of the game can be
+        # found without replaying the game
         class CustomBoard(chess.Board):
             def __init__(self):
+                # the number of times each position (keyed by its transposition key) has occurred in the game, None
+                # when it needs to be recounted, and the number of positions which have occurred at least twice
+                self.repetitions = None
+                self.repeated = 0
+
+                # the state of the current position, None when it needs to be found
+                self.state = None
+
                 super().__init__()
                 self.reset()
 
+            def push(self, move):
+                if self.repetitions is None:
+                    self.count_repetitions()
+
+                super().push(move)
+                self.add_repetition(self._transposition_key(), 1)
+                self.state = None
+
+            def pop(self):
+                if self.repetitions is None:
+                    self.count_repetitions()
+
+                self.add_repetition(self._transposition_key(), -1)
+                self.state = None
+                return super().pop()
+
+            # the position counts are rebuilt after the position is replaced (by reset, set_fen, etc.)
+            def clear_stack(self):
+                super().clear_stack()
+                self.repetitions = None
+                self.state = None
+
+            # change the number of times a position has occurred
+            def add_repetition(self, key, change):
+                count = self.repetitions.get(key, 0)
+
+                if count < 2 <= count + change:
+                    self.repeated += 1
+                elif count + change < 2 <= count:
+                    self.repeated -= 1
+
+                if count + change > 0:
+                    self.repetitions[key] = count + change
+                else:
+                    del self.repetitions[key]
+
+            # count the positions of the game by replaying it from its starting position
+            def count_repetitions(self):
+                moves = []
+                while self.move_stack:
+                    moves.append(chess.Board.pop(self))
+
+                self.repetitions = {}
+                self.repeated = 0
+                self.add_repetition(self._transposition_key(), 1)
+
+                while moves:
+                    chess.Board.push(self, moves.pop())
+                    self.add_repetition(self._transposition_key(), 1)
+
+            # the state of the game (see Game.current_state), found with a single generation of the legal moves
+            def game_state(self):
+                if self.state is None:
+                    self.state = self.find_state()
+
+                return self.state
+
+            def find_state(self):
+                if self.repetitions is None:
+                    self.count_repetitions()
+
+                moves = list(self.generate_legal_moves())
+
+                if not moves and not self.is_check():
+                    return "stalemate"
+                elif self.is_insufficient_material():
+                    return "insufficient_material"
+                elif moves and self.can_claim_repetition(moves):
+                    return "threefold"
+                elif moves and self.can_claim_fifty(moves):
+                    return "fifty_moves"
+                elif moves and self.halfmove_clock >= 150:
+                    return "seventyfive_moves"
+                elif not moves:
+                    return "checkmate"
+                else:
+                    return "none"
+
+            # check if a draw can be claimed by threefold repetition, either because the position has occurred three
+            # times or because one of the legal moves leads to a position which has already occurred twice
+            def can_claim_repetition(self, moves):
+                if self.repetitions[self._transposition_key()] >= 3:
+                    return True
+
+                # no move can lead to a third repetition if no position has occurred twice, and moves which capture or
+                # move a pawn lead to positions which cannot have occurred before
+                if not self.repeated:
+                    return False
+
+                for move in moves:
+                    if self.is_zeroing(move):
+                        continue
+
+                    chess.Board.push(self, move)
+                    count = self.repetitions.get(self._transposition_key(), 0)
+                    chess.Board.pop(self)
+
+                    if count >= 2:
+                        return True
+
+                return False
+
+            # check if a draw can be claimed by the fifty move rule, either now or with one of the legal moves
+            def can_claim_fifty(self, moves):
+                if self.halfmove_clock >= 100:
+                    return True
+
+                if self.halfmove_clock < 99:
+                    return False
+
+                for move in moves:
+                    if self.is_zeroing(move):
+                        continue
+
+                    # the game must not have ended after the move
+                    chess.Board.push(self, move)
+                    has_moves = any(self.generate_legal_moves())
+                    chess.Board.pop(self)
+
+                    if has_moves:
+                        return True
+
+                return False
+
             def verify_fen(self, fen):
                 if fen == self.fen():
                     return True
                 else:
                     return False
 
-        def __init__(self, player_data, ai_data, player_color, ai_game):
+        def __init__(self, player_data, ai_data, player_color, ai_game, session_timeout=900):
             self.ai_game = ai_game
 
+            # the number of seconds without an action before the game times out
+            self.session_timeout = session_timeout
+
             # session information
             self.session_url = secrets.token_urlsafe(16)
             self.session_secret = secrets.token_urlsafe(32)
 
-            # a datetime which represents the time at which the last action was made in this game
+            # a datetime which represents the time at which the last action was made in this game, and the time (from
+            # time.time() so that it is the same in every server process) at which the game will time out
             self.last_action = datetime.datetime.now()
+            self.deadline = time.time() + self.session_timeout
+
+            # held while the game is being read or changed so that events for the same game are handled one at a time
+            self.lock = threading.RLock()
+
+            # the cancellation token of the ai move being made, used to stop the ai's search if the game is deleted
+            self.ai_cancel_token = None
+
+            # the search statistics of the last ai move
+            self.last_search_stats = None
 
             # game board
             self.board = self.CustomBoard()
@@ -127,23 +315,49 @@ class GameManager:
             return
 
         # make a move using the ai
-        def ai_move(self):
-            if self.ai_game:
-                if self.board.turn == chess.WHITE:
-                    print("MAKING WHITE MOVE USING: " + self.player.username)
-                    try:
-                        move = self.player.get_move(self.fen())
-                    except Exception as e:
-                        print(e)
-                else:
-                    print("MAKING WHITE MOVE USING: " + self.ai.username)
-                    move = self.ai.get_move(self.fen())
+        # start an ai move (called holding the game's lock), returns (the player making the move, the fen, the moves of
+        # the game so far, the move's cancellation token) for the move to be found without holding the lock, or None if
+        # it is not the ai's turn
+        def start_ai_move(self):
+            # the ai only moves on its own turn
+            if not self.ai_game and (self.board.turn == chess.WHITE) != (self.ai.color == "w"):
+                return None
+
+            cancel_token = chess_ai.CancellationToken()
+            self.ai_cancel_token = cancel_token
+
+            if self.ai_game and self.board.turn == chess.WHITE:
+                print("MAKING WHITE MOVE USING: " + self.player.username)
+                mover = self.player
+            elif self.ai_game:
+                print("MAKING BLACK MOVE USING: " + self.ai.username)
+                mover = self.ai
             else:
-                # the move the ai wants to make
-                move = self.ai.get_move(self.fen())
+                mover = self.ai
+
+            # the moves of the game so far, the game always starts from the starting position
+            return mover, self.fen(), list(self.board.move_stack), cancel_token
+
+        # find the move of an ai move started by start_ai_move, called without holding the game's lock so that the
+        # game can be read while the ai is thinking
+        @staticmethod
+        def find_ai_move(mover, fen, moves, cancel_token):
+            try:
+                return mover.get_move(fen, cancel_token, moves)
+            except Exception as e:
+                print(e)
+                return None
 
-            # in the case the move is None
-            if move is None:
+        # finish an ai move (called holding the game's lock), the move is only made if the game has not changed since
+        # the move was started, returns the string of the move or None if no move was made
+        def finish_ai_move(self, mover, moves, cancel_token, move):
+            if self.ai_cancel_token is cancel_token:
+                self.ai_cancel_token = None
+
+            self.last_search_stats = mover.search_stats()
+
+            # in the case the move is None or the game changed while the ai was thinking
+            if move is None or self.board.move_stack != moves:
                 return None
 
             print("AI MOVE: " + move.uci())
@@ -154,76 +368,56 @@ class GameManager:
             # return the string value of the move
             return move.uci()
 
-        # resets the last_action datetime value to the current time
+        # stop the ai move being made (if there is one)
+        def cancel_ai_move(self):
+            cancel_token = self.ai_cancel_token
+
+            if cancel_token is not None:
+                cancel_token.cancel()
+
+        # the kind of game, "ai_vs_ai" or "player_vs_ai"
+        def mode(self):
+            return "ai_vs_ai" if self.ai_game else "player_vs_ai"
+
+        # resets the last_action datetime value to the current time and pushes back the game's deadline
         def reset_timeout(self):
             self.last_action = datetime.datetime.now()
+            self.deadline = time.time() + self.session_timeout
 
         # checks if there is a special state of the board
         def current_state(self):
-            if self.board.is_stalemate():
-                return "stalemate"
-            elif self.board.is_insufficient_material():
-                return "insufficient_material"
-            elif self.board.can_claim_threefold_repetition():
-                return "threefold"
-            elif self.board.can_claim_fifty_moves():
-                return "fifty_moves"
-            elif self.board.is_fivefold_repetition():
-                return "fivefold"
-            elif self.board.is_seventyfive_moves():
-                return "seventyfive_moves"
-            elif self.board.is_checkmate():
-                return "checkmate"
-            else:
-                return "none"
+            return self.board.game_state()
 
         # attempt to make a move, if the move is not valid then return false
         def make_move(self, move):
-            # set the promotion
-            move.promotion = chess.QUEEN
-
-            # check if the move is valid with promotion
-            if move in self.board.legal_moves:
-                # if the move is legal then register it
-                self.board.push(move)
-
-                # return the move was validated
-                return True
-
-            # if promotion move fails then try move without promotion
-            move.promotion = None
-
-            # check if the move is valid without promotion
-            if move in self.board.legal_moves:
-                # if the move is legal then register it
-                self.board.push(move)
+            move = self.resolve_move(move)
 
-                # return the move was validated
-                return True
-            else:
+            if move is None:
                 # return that the move was not validated
                 return False
 
+            # if the move is legal then register it
+            self.board.push(move)
+
+            # return the move was validated
+            return True
+
         # check if a move is a valid move returns a bool
         def check_move(self, move):
-            # set the promotion
-            move.promotion = chess.QUEEN
+            return self.resolve_move(move) is not None
 
-            # check if the move is valid with promotion
-            if move in self.board.legal_moves:
-                # return the move was validated
-                return True
+        # returns the legal move matching a move sent by a client or None if it is not legal, a pawn move to the last
+        # rank without a promotion piece promotes to a queen
+        def resolve_move(self, move):
+            if move.promotion is None and chess.BB_SQUARES[move.to_square] & chess.BB_BACKRANKS:
+                if self.board.piece_type_at(move.from_square) == chess.PAWN:
+                    move = chess.Move(move.from_square, move.to_square, chess.QUEEN)
 
-            # if promotion move fails then try move without promotion
-            move.promotion = None
+            # a single pseudo-legal and pin/check test of the move rather than generating every legal move
+            if self.board.is_legal(move):
+                return move
 
-            # check if the move is valid without promotion
-            if move in self.board.legal_moves:
-                # return the move was validated
-                return True
-            else:
-                # return that the move was not validated
-                return False
+            return None
 
         # compare the fen of the client board and the server board and update based on that
         def fen(self):
@@ -231,13 +425,7 @@ class GameManager:
 
         # checks if the game session has timed out returns a bool
         def session_timed_out(self):
-            time_delta = datetime.datetime.now() - self.last_action
-
-            # check if the difference between the current time and the time since the last action is 15 min or more
-            if time_delta >= datetime.timedelta(minutes=15):
-                return True
-            else:
-                return False
+            return time.time() >= self.deadline
 
         # return the player data as a dict
         def game_info(self):
@@ -257,12 +445,69 @@ class GameManager:
                 self.session_secret
             )
 
-    def __init__(self, timeout_check_delay = 15):
-        # the delay between checking if games are still alive
-        self.timeout_check_delay = timeout_check_delay
+        # return the game as a compact dict which the game can be recreated from (see game_store.py)
+        def record(self):
+            return {
+                "session_url": self.session_url,
+                "session_secret": self.session_secret,
+                "ai_game": self.ai_game,
+                "player": self.player.record(),
+                "ai": self.ai.record(),
+                "moves": " ".join(move.uci() for move in self.board.move_stack),
+                "last_action": self.last_action.timestamp(),
+                "deadline": self.deadline
+            }
+
+        # bring the game up to date with a record of it, the players are kept (so their AIs stay warm) and the board
+        # only makes or unmakes the moves which differ from the record
+        def load_record(self, record):
+            self.session_url = record["session_url"]
+            self.session_secret = record["session_secret"]
+            self.last_action = datetime.datetime.fromtimestamp(record["last_action"])
+            self.deadline = record["deadline"]
+
+            # changing an ai's color clears its transposition table so the colors are only set if they have changed
+            if self.player.color != record["player"]["color"]:
+                self.player.set_color(record["player"]["color"])
+            if self.ai.color != record["ai"]["color"]:
+                self.ai.set_color(record["ai"]["color"])
+
+            moves = [chess.Move.from_uci(move) for move in record["moves"].split()]
+
+            # the number of moves the board and the record have in common
+            stack = self.board.move_stack
+            common = 0
+            limit = min(len(stack), len(moves))
+            while common < limit and stack[common] == moves[common]:
+                common += 1
+
+            while len(stack) > common:
+                self.board.pop()
+
+            for move in moves[common:]:
+                self.board.push(move)
+
+    # store is where the games are kept (see game_store.py, games are kept in memory by default) and ai_factory creates
+    # an AI player from its id, used to recreate the games kept by a store shared with other processes
+    def __init__(self, session_timeout=900, store=None, ai_factory=None):
+        # the number of seconds without an action before a game times out
+        self.session_timeout = session_timeout
 
-        # a list of current ongoing games
-        self.__games = []
+        # the ongoing games (each game has its own lock for changes to the game itself)
+        if store is None:
+            store = game_store.MemoryGameStore()
+        self.store = store
+        self.ai_factory = ai_factory
+        self.store.open(self.load_game)
+
+        # notified when a game is added or the manager's running state changes
+        self.__expiry_condition = threading.Condition()
+
+        # the totals of the search statistics of every ai move, by ai type
+        self.__search_totals = SearchStatsTotals()
+
+        # set to False to stop the background threads
+        self.__running = True
 
         # a list of background task threads
         self.__threads = []
@@ -270,101 +515,346 @@ class GameManager:
         # start background threads
         self.__start_threads()
 
+    # get the game with a given session url, returns None if there is no matching game, the game must be refreshed
+    # (holding its lock) before it is used
+    def __get_game(self, session_url):
+        return self.store.get(session_url)
+
+    # recreate a game from its record (see Game.record)
+    def load_game(self, record):
+        players = []
+        for player_record in (record["player"], record["ai"]):
+            if player_record["type"] == "ai":
+                player = self.ai_factory(player_record["id"])
+
+                if player is None:
+                    raise ValueError("unknown ai: " + str(player_record["id"]))
+
+                player.username = player_record["name"]
+            else:
+                player = Player(player_record["name"], player_record["id"])
+
+            players.append(player)
+
+        game = self.Game(players[0], players[1], record["player"]["color"], record["ai_game"], self.session_timeout)
+        game.load_record(record)
+
+        return game
+
     # check if a given session url has a matching game in the manager
     def check_session(self, session_url):
-        # check if a given session_url exists
-        for game in self.__games:
-            if game.session_url == session_url:
-                return True
-        return False
+        game = self.__get_game(session_url)
+        if game is None:
+            return False
+
+        with game.lock:
+            return self.store.refresh(game)
 
     # creates a new game with some given player data
     def create_game(self, player_data, ai_data, player_color="r", ai_game=False):
         # create a new game
-        new_game = self.Game(player_data, ai_data, player_color, ai_game)
+        new_game = self.Game(player_data, ai_data, player_color, ai_game, self.session_timeout)
+
+        # add the game to the manager and schedule its timeout
+        self.store.add(new_game)
 
-        # add the game to the list
-        self.__games.append(new_game)
+        with self.__expiry_condition:
+            self.__expiry_condition.notify()
+
+        sessions_created.inc(new_game.mode())
 
         # return the new games session info
         return new_game.session_info()
 
     # get the player data of a given game given its url token, returns None if the url doesnt match a current game
     def player_data(self, session_url):
-        for game in self.__games:
-            if game.session_url == session_url:
-                return game.game_info()
-        return None
+        game = self.__get_game(session_url)
+        if game is None:
+            return None
+
+        with game.lock:
+            if not self.store.refresh(game):
+                return None
+
+            return game.game_info()
 
     # verify a move sent by a client
     def verify_move(self, session_url, move):
         # find the game with the matching session_url
-        for game in self.__games:
+        game = self.__get_game(session_url)
+        if game is None:
+            return None
+
+        with game.lock:
+            if not self.store.refresh(game):
+                return None
+
             # resets the game's timeout counter
             game.reset_timeout()
 
-            if game.session_url == session_url:
-                # verify the move
-                verification_status = game.make_move(
-                    chess.Move.from_uci(move["move"]["source"] + move["move"]["target"]))
+            # verify the move (with the piece a pawn is promoted to if the client sent one)
+            try:
+                client_move = chess.Move.from_uci(
+                    move["move"]["source"] + move["move"]["target"] + (move["move"].get("promotion") or ""))
+            except ValueError:
+                client_move = None
 
-                # get the board state
-                board_state = game.current_state()
+            verification_status = client_move is not None and game.make_move(client_move)
 
-                # board fen
-                board_fen = game.board.fen()
+            # another server process changed the game first, the game is reloaded and the move is refused
+            if not self.store.save(game):
+                if not self.store.refresh(game):
+                    return None
 
-                return verification_status, board_state, board_fen
-        return None
+                verification_status = False
 
-    # makes a move using the ai
+            # get the board state
+            board_state = game.current_state()
+
+            # board fen
+            board_fen = game.board.fen()
+
+            return verification_status, board_state, board_fen
+
+    # makes a move using the ai, returns the game's fen and state, the move and the search statistics of the move, the
+    # game's lock is not held while the ai is thinking
     def ai_move(self, session_url):
-        for game in self.__games:
-            if game.session_url == session_url:
-                # resets the game's timeout counter
-                game.reset_timeout()
+        game = self.__get_game(session_url)
+        if game is None:
+            return None
+
+        with game.lock:
+            if not self.store.refresh(game):
+                return None
 
-                # has the ai make a move, returns the string of the move
-                move = game.ai_move()
+            # resets the game's timeout counter
+            game.reset_timeout()
+            self.store.save(game)
 
-                return game.fen(), game.current_state(), move
-        return None
+            ai_move = game.start_ai_move()
+            if ai_move is None:
+                return game.fen(), game.current_state(), None, None
+
+        mover, fen, moves, cancel_token = ai_move
+        move = game.find_ai_move(mover, fen, moves, cancel_token)
+
+        with game.lock:
+            # the game was removed while the ai was thinking
+            if not self.store.refresh(game):
+                return None
+
+            # make the move, unless the game changed while the ai was thinking
+            move = game.finish_ai_move(mover, moves, cancel_token, move)
+            stats = game.last_search_stats if move is not None else None
+
+            # another server process changed the game since it was refreshed, the game is reloaded and the move is
+            # thrown away
+            if not self.store.save(game):
+                if not self.store.refresh(game):
+                    return None
 
-    # delete a given game
+                move = None
+                stats = None
+
+            if stats is not None:
+                self.__search_totals.add(stats)
+
+            return game.fen(), game.current_state(), move, stats
+
+    # returns the totals of the search statistics of every ai move, by ai type
+    def search_stats(self):
+        return self.__search_totals.summary()
+
+    # delete a given game, stopping any ai move being made for it
     def delete_game(self, session_url):
-        for game in self.__games:
-            if game.session_url == session_url:
-                self.__games.remove(game)
+        removed, game = self.store.remove(session_url)
+
+        if game is not None:
+            game.cancel_ai_move()
+
+        if removed:
+            sessions_deleted.inc()
 
         return
 
+    # returns the number of ongoing games of each mode, keyed by (mode,)
+    def game_counts(self):
+        return self.store.count_by_mode()
+
     # returns the fen of a given board
     def get_fen(self, session_url):
-        for game in self.__games:
-            if game.session_url == session_url:
-                return game.board.fen()
-        return None
+        game = self.__get_game(session_url)
+        if game is None:
+            return None
 
-    # checks the timeout of games and will delete the game if it has timed out
+        with game.lock:
+            if not self.store.refresh(game):
+                return None
+
+            return game.board.fen()
+
+    # deletes games as they time out, waking only when the game with the earliest deadline could have timed out (or
+    # every so often if the store is shared, as games added by other processes do not wake the thread)
     def __check_timeouts(self):
-        while True:
-            # delay between checks
-            time.sleep(self.timeout_check_delay)
+        with self.__expiry_condition:
+            while self.__running:
+                try:
+                    deadline = self.store.next_deadline()
+
+                    # wait until the earliest deadline (or until a game is added if there are none)
+                    timeout = game_store.EXPIRY_POLL_INTERVAL if self.store.shared else None
+                    if deadline is not None:
+                        timeout = deadline - time.time() if timeout is None else min(timeout, deadline - time.time())
+
+                    if timeout is None or timeout > 0:
+                        self.__expiry_condition.wait(timeout)
 
-            # check if each game has timed out
-            for game in self.__games:
-                # if the game has  timed out remove it from the list of ongoing games
-                if game.session_timed_out():
-                    self.__games.remove(game)
+                    if not self.__running:
+                        break
+
+                    # remove the games which have timed out, stopping any ai move being made for them
+                    for session_url, game in self.store.remove_expired(time.time()):
+                        if game is not None:
+                            game.cancel_ai_move()
+
+                        sessions_expired.inc()
+                except Exception as e:
+                    print("ERROR: ")
+                    print(e)
+                    self.__expiry_condition.wait(1.0)
 
     # starts all background task threads of the manager
     def __start_threads(self):
         # add the thread which checks the game timeouts
-        self.__threads.append(threading.Thread(target=self.__check_timeouts, daemon=False))
+        self.__threads.append(threading.Thread(target=self.__check_timeouts, daemon=True))
 
         # start all of the threads
         for thread in self.__threads:
             thread.start()
 
+    # stops the background task threads of the manager
+    def shutdown(self):
+        with self.__expiry_condition:
+            self.__running = False
+            self.__expiry_condition.notify_all()
 
+        for thread in self.__threads:
+            thread.join()
+
+        self.store.close()
+
+
+# the totals of the search statistics (chess_ai.SearchStats) of ai moves, kept separately for each type of ai
+class SearchStatsTotals:
+    # the statistics which are added up
+    FIELDS = ("elapsed", "nodes", "leaf_evals", "beta_cutoffs", "first_move_cutoffs", "tt_probes", "tt_hits",
+              "tt_cutoffs")
+
+    def __init__(self):
+        # the totals of each ai type, keyed by the name of the type
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    # add the statistics of a move
+    def add(self, stats):
+        with self.lock:
+            totals = self.totals.get(stats.engine)
+            if totals is None:
+                totals = dict.fromkeys(self.FIELDS + ("moves", "searches", "depth", "book_moves", "cache_hits"), 0)
+                self.totals[stats.engine] = totals
+
+            totals["moves"] += 1
+
+            if stats.book_move:
+                totals["book_moves"] += 1
+                return
+            if stats.cache_hit:
+                totals["cache_hits"] += 1
+                return
+
+            # only searched moves count towards the search totals
+            totals["searches"] += 1
+            for field in self.FIELDS:
+                totals[field] += getattr(stats, field)
+            totals["depth"] += stats.depth or 0
+
+    # returns the totals of each ai type as a dict, with the averages and rates found from them
+    def summary(self):
+        with self.lock:
+            summary = {}
+
+            for engine, totals in self.totals.items():
+                searches = totals["searches"]
+
+                summary[engine] = dict(
+                    totals,
+                    mean_elapsed=totals["elapsed"] / searches if searches else 0.0,
+                    mean_nodes=totals["nodes"] / searches if searches else 0.0,
+                    mean_depth=totals["depth"] / searches if searches else 0.0,
+                    nodes_per_second=totals["nodes"] / totals["elapsed"] if totals["elapsed"] else 0.0,
+                    first_move_cutoff_rate=(totals["first_move_cutoffs"] / totals["beta_cutoffs"]
+                                            if totals["beta_cutoffs"] else 0.0),
+                    tt_hit_rate=totals["tt_hits"] / totals["tt_probes"] if totals["tt_probes"] else 0.0
+                )
+
+            return summary
+
+
+# runs ai moves in an executor, a game only ever has one ai move job queued or running so repeated requests for the
+# same game are merged into one and a game's moves are made one at a time, if a job makes no move (it may have checked
+# whose turn it is before the move of a request made in the meantime) it is run again for the requests merged into it
+class AIMoveScheduler:
+    def __init__(self, manager, executor):
+        self.manager = manager
+        self.executor = executor
+
+        # the games with an ai move job, the session urls of the games keyed to the on_move of the request to run the
+        # job again for once it is done (None if there is no such request)
+        self.__jobs = {}
+        self.__jobs_lock = threading.Lock()
+
+    # queue an ai move for a game, on_move(session_url, fen, state, move, stats) is called from the executor once the
+    # move is made (stats is the move's chess_ai.SearchStats or None), returns False if the game already has an ai move
+    # job (the job is then run again if it makes no move)
+    def submit(self, session_url, on_move):
+        with self.__jobs_lock:
+            if session_url in self.__jobs:
+                self.__jobs[session_url] = on_move
+                return False
 
+            self.__jobs[session_url] = None
+
+        ai_move_jobs.inc("queued")
+        self.executor.submit(self.__run, session_url, on_move, time.monotonic())
+        return True
+
+    def __run(self, session_url, on_move, submitted):
+        start = time.monotonic()
+        ai_move_jobs.dec("queued")
+        ai_move_jobs.inc("running")
+        ai_move_wait.observe(start - submitted)
+
+        try:
+            result = self.manager.ai_move(session_url)
+        except Exception as e:
+            print("ERROR: ")
+            print(e)
+            result = None
+        finally:
+            ai_move_jobs.dec("running")
+
+            # the job is finished before on_move is called so that a request sent in reply to the move is not merged
+            # into this job
+            with self.__jobs_lock:
+                rerun = self.__jobs.pop(session_url, None)
+
+        # send the move (unless the game was deleted or the ai did not move)
+        if result is not None and result[2] is not None:
+            fen, state, move, stats = result
+            ai_move_latency.observe(time.monotonic() - start, stats.engine if stats is not None else "unknown")
+            on_move(session_url, fen, state, move, stats)
+
+        # the job made no move for a game which still exists but a request was merged into it, the request may have been
+        # made after the job found it was not the ai's turn so the job is run again for it
+        if rerun is not None and result is not None and result[2] is None:
+            self.submit(session_url, rerun)
@@ -0,0 +1,337 @@
+import heapq
+import json
+import sqlite3
+import threading
+import time
+
+"""
+    Stores of the ongoing games used by the game manager.
+
+    MemoryGameStore keeps the games in the server's memory, only one server process can then be run. SQLiteGameStore
+    keeps a compact record of each game (the players, the moves and when the game times out) in a SQLite database so
+    that any number of server processes on the same machine can serve any game. Each process keeps the games it has
+    used so their AIs stay warm, a game is only reloaded from its record when another process has changed it.
+
+    Each change to a game is saved with the version of the record it was made from, a save fails if another process
+    has saved a change in the meantime (the change is then thrown away and the game reloaded) so processes never need
+    to hold a lock on a game while an AI is thinking.
+"""
+
+# the longest a shared store goes without checking for timed out games, games added by other processes are not known
+# to the process so their deadlines are only seen when the store is checked
+EXPIRY_POLL_INTERVAL = 30.0
+
+
+# keeps the games in memory, the games are the game manager's Game objects
+class MemoryGameStore:
+    # whether the store is shared with other processes
+    shared = False
+
+    def __init__(self):
+        # the games keyed by their session url
+        self.games = {}
+
+        # a heap of (deadline, session_url) of the games in order of when they could time out, each game has one entry
+        # which is only moved when it is reached and the game's deadline has been pushed back
+        self.expiry_heap = []
+
+        self.lock = threading.Lock()
+
+    # called by the game manager with the function which creates a game from its record, not needed by this store
+    def open(self, load_game):
+        pass
+
+    def close(self):
+        pass
+
+    # add a new game
+    def add(self, game):
+        with self.lock:
+            self.games[game.session_url] = game
+            heapq.heappush(self.expiry_heap, (game.deadline, game.session_url))
+
+    # get the game with a given session url, returns None if there is no matching game
+    def get(self, session_url):
+        with self.lock:
+            return self.games.get(session_url)
+
+    # bring a game up to date with the store (called holding the game's lock), returns False if it has been removed
+    def refresh(self, game):
+        with self.lock:
+            return game.session_url in self.games
+
+    # save the changes made to a game (called holding the game's lock), returns False if the game has been removed
+    def save(self, game):
+        with self.lock:
+            return game.session_url in self.games
+
+    # remove a game, returns (whether the game was removed, the removed game)
+    def remove(self, session_url):
+        with self.lock:
+            game = self.games.pop(session_url, None)
+
+        return game is not None, game
+
+    # the earliest time (from time.time()) a game could time out, None if there are no games
+    def next_deadline(self):
+        with self.lock:
+            if not self.expiry_heap:
+                return None
+
+            return self.expiry_heap[0][0]
+
+    # remove the games which have timed out by a given time, returns a list of (session url, removed game)
+    def remove_expired(self, now):
+        removed = []
+
+        with self.lock:
+            # go through the games whose deadline has been reached
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                deadline, session_url = heapq.heappop(self.expiry_heap)
+                game = self.games.get(session_url)
+
+                # the game has already been removed
+                if game is None:
+                    continue
+
+                # if the game's deadline was pushed back then move it to its new deadline, otherwise it has timed out
+                if game.deadline > now:
+                    heapq.heappush(self.expiry_heap, (game.deadline, session_url))
+                else:
+                    del self.games[session_url]
+                    removed.append((session_url, game))
+
+        return removed
+
+    # the number of games of each mode, keyed by (mode,)
+    def count_by_mode(self):
+        counts = {("player_vs_ai",): 0, ("ai_vs_ai",): 0}
+
+        with self.lock:
+            for game in self.games.values():
+                counts[(game.mode(),)] += 1
+
+        return counts
+
+
+# keeps a record of each game in a SQLite database shared by the server processes, each record is the JSON of the
+# game's Game.record()
+class SQLiteGameStore:
+    shared = True
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+
+        # a connection for each thread
+        self.connections = threading.local()
+
+        # the games this process has used and the version of the record each was loaded from or last saved as, keyed
+        # by session url
+        self.games = {}
+        self.versions = {}
+
+        # a heap of (deadline, session_url) of the games this process has in order of when they could time out (as in
+        # MemoryGameStore), so that the games which have timed out are no longer kept without checking every game
+        self.expiry_heap = []
+
+        self.lock = threading.Lock()
+
+        # creates a game from its record, set by the game manager
+        self.load_game = None
+
+        self.connection().executescript("""
+            CREATE TABLE IF NOT EXISTS games (
+                session_url TEXT PRIMARY KEY,
+                mode TEXT NOT NULL,
+                deadline REAL NOT NULL,
+                version INTEGER NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS games_deadline ON games (deadline);
+        """)
+
+    # called by the game manager with the function which creates a game from its record
+    def open(self, load_game):
+        self.load_game = load_game
+
+    def close(self):
+        connection = getattr(self.connections, "connection", None)
+
+        if connection is not None:
+            connection.close()
+            self.connections.connection = None
+
+    # the connection of the current thread, statements are committed as they are run unless they are in an explicit
+    # transaction
+    def connection(self):
+        connection = getattr(self.connections, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+            # readers do not block the writer (or each other) in write ahead log mode
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+            self.connections.connection = connection
+
+        return connection
+
+    # add a new game
+    def add(self, game):
+        self.connection().execute(
+            "INSERT INTO games (session_url, mode, deadline, version, record) VALUES (?, ?, ?, 1, ?)",
+            (game.session_url, game.mode(), game.deadline, json.dumps(game.record(), separators=(",", ":")))
+        )
+
+        with self.lock:
+            self.games[game.session_url] = game
+            self.versions[game.session_url] = 1
+            heapq.heappush(self.expiry_heap, (game.deadline, game.session_url))
+
+    # get the game with a given session url (loading it if this process does not have it), returns None if there is no
+    # matching game, the game may be out of date until it is refreshed
+    def get(self, session_url):
+        with self.lock:
+            game = self.games.get(session_url)
+
+        if game is not None:
+            return game
+
+        row = self.connection().execute(
+            "SELECT version, record FROM games WHERE session_url = ?", (session_url,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        version, record = row
+        game = self.load_game(json.loads(record))
+
+        # another thread may have loaded the game at the same time, only one copy of it is kept
+        with self.lock:
+            if session_url in self.games:
+                return self.games[session_url]
+
+            self.games[session_url] = game
+            self.versions[session_url] = version
+            heapq.heappush(self.expiry_heap, (game.deadline, session_url))
+
+        return game
+
+    # bring a game up to date with the store (called holding the game's lock), returns False if it has been removed
+    def refresh(self, game):
+        session_url = game.session_url
+        connection = self.connection()
+
+        row = connection.execute("SELECT version FROM games WHERE session_url = ?", (session_url,)).fetchone()
+
+        if row is None:
+            self.forget(session_url)
+            return False
+
+        with self.lock:
+            if self.versions.get(session_url) == row[0]:
+                return True
+
+        row = connection.execute(
+            "SELECT version, record FROM games WHERE session_url = ?", (session_url,)
+        ).fetchone()
+
+        if row is None:
+            self.forget(session_url)
+            return False
+
+        version, record = row
+        game.load_record(json.loads(record))
+
+        with self.lock:
+            self.versions[session_url] = version
+
+        return True
+
+    # save the changes made to a game (called holding the game's lock), returns False if another process has changed
+    # or removed the game since it was loaded, the game is then reloaded by the next refresh
+    def save(self, game):
+        session_url = game.session_url
+
+        with self.lock:
+            version = self.versions.get(session_url)
+
+        cursor = self.connection().execute(
+            "UPDATE games SET deadline = ?, version = version + 1, record = ? WHERE session_url = ? AND version = ?",
+            (game.deadline, json.dumps(game.record(), separators=(",", ":")), session_url, version)
+        )
+
+        with self.lock:
+            if cursor.rowcount:
+                self.versions[session_url] = version + 1
+                return True
+
+            self.versions[session_url] = None
+            return False
+
+    # stop keeping a game in this process
+    def forget(self, session_url):
+        with self.lock:
+            self.versions.pop(session_url, None)
+            return self.games.pop(session_url, None)
+
+    # remove a game, returns (whether the game was removed, the removed game if this process had it)
+    def remove(self, session_url):
+        cursor = self.connection().execute("DELETE FROM games WHERE session_url = ?", (session_url,))
+
+        return cursor.rowcount > 0, self.forget(session_url)
+
+    # the earliest time (from time.time()) a game could time out, None if there are no games
+    def next_deadline(self):
+        return self.connection().execute("SELECT MIN(deadline) FROM games").fetchone()[0]
+
+    # remove the games which have timed out by a given time, returns a list of (session url, removed game if this
+    # process had it)
+    def remove_expired(self, now):
+        connection = self.connection()
+
+        # the games are found and removed in one transaction so that each game is only removed by one process
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            session_urls = [row[0] for row in connection.execute(
+                "SELECT session_url FROM games WHERE deadline <= ?", (now,)
+            )]
+            connection.execute("DELETE FROM games WHERE deadline <= ?", (now,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        removed = [(session_url, self.forget(session_url)) for session_url in session_urls]
+
+        # games which timed out and were removed by another process are no longer kept by this one (a game kept here
+        # which has been played in another process since is only loaded again if it is used)
+        with self.lock:
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                deadline, session_url = heapq.heappop(self.expiry_heap)
+                game = self.games.get(session_url)
+
+                # the game is no longer kept
+                if game is None:
+                    continue
+
+                # if the game's deadline was pushed back then move it to its new deadline, otherwise it is forgotten
+                if game.deadline > now:
+                    heapq.heappush(self.expiry_heap, (game.deadline, session_url))
+                else:
+                    self.versions.pop(session_url, None)
+                    del self.games[session_url]
+
+        return removed
+
+    # the number of games of each mode, keyed by (mode,)
+    def count_by_mode(self):
+        counts = {("player_vs_ai",): 0, ("ai_vs_ai",): 0}
+
+        for mode, count in self.connection().execute("SELECT mode, COUNT(*) FROM games GROUP BY mode"):
+            counts[(mode,)] = count
+
+        return counts
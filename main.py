@@ -1,7 +1,12 @@
-from flask import Flask, render_template, redirect, request
+from flask import Flask, Response, render_template, redirect, request
 from flask_socketio import SocketIO, emit, join_room
+import os
 import secrets
 import chess_ai
+import ai_workers
+import engine_pool
+import game_store
+import metrics
 from concurrent.futures import ThreadPoolExecutor
 import game_manager as gm
 
@@ -9,7 +14,7 @@ import game_manager as gm
     licence
     Once the flask app is launched go to the following url in a web browser to play an AI: 'localhost:5000'
     > The page styles are designed and tested using Chrome 
-    > There are technically 5 different AI's implemented (including a random AI)
+    > There are technically 6 different AI's implemented (including a random AI)
     > Currently you cannot play an AI against an AI (desired feature if enough time)
 
     > This project makes use of the following non-standard libraries:
@@ -22,20 +27,108 @@ import game_manager as gm
         - socket.io.js - used for the client side socketio communications 
 """
 
+# where the games are kept, the path of a SQLite database shared by every server process (so that the server can be
+# run with more than one worker process) or None to keep them in the server's memory (only one worker can then be run)
+GAME_STORE_PATH = os.environ.get("GAME_STORE_PATH")
+
+# the url of the message queue (such as redis://localhost:6379) the server processes send socket messages through so
+# that a message reaches a game's players whichever process they are connected to, needed with more than one worker
+# process (the queue's client library, such as redis, must be installed)
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE")
+
+# the options the pages' socket.io clients connect with, with more than one worker process the clients only use
+# websockets as the long polling requests of a client could be sent to different processes
+SOCKETIO_CLIENT_OPTIONS = {"transports": ["websocket"]} if SOCKETIO_MESSAGE_QUEUE else {}
+
 # flask app config and instance creation
 app = Flask("Chess AI", template_folder="templates",
             static_folder="static")
-app.config['SECRET_KEY'] = secrets.token_urlsafe(32)
+app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY") or secrets.token_urlsafe(32)
 
 # socketIO config
-socket_io = SocketIO(app, async_mode='threading')
+socket_io = SocketIO(app, async_mode='threading', message_queue=SOCKETIO_MESSAGE_QUEUE)
 
-# create
-manager = gm.GameManager()
+# create, the games kept in a shared store are recreated with their AIs by name
+if GAME_STORE_PATH:
+    manager = gm.GameManager(store=game_store.SQLiteGameStore(GAME_STORE_PATH),
+                             ai_factory=lambda ai_name: get_ai_by_name(ai_name))
+else:
+    manager = gm.GameManager()
 
 # thread pool
 pool = ThreadPoolExecutor(max_workers=32)
 
+# runs the ai moves of each game in the thread pool one at a time
+scheduler = gm.AIMoveScheduler(manager, pool)
+
+# server metrics shown by the /metrics page (see metrics.py), the metrics of the games and ai moves are kept by the game
+# manager
+socket_events = metrics.Counter("chess_socket_events_total", "Socket events received, by event.", ["event"])
+socket_messages = metrics.Counter("chess_socket_messages_sent_total", "Socket messages sent, by event.", ["event"])
+active_games = metrics.Gauge("chess_active_games", "Ongoing games, by mode.", ["mode"], function=manager.game_counts)
+engine_pool_engines = metrics.Gauge(
+    "chess_engine_pool_engines", "AIs in the engine pools, by pool and whether they are in use.", ["pool", "state"],
+    function=lambda: {(name, state): stats[state] for name, stats in engine_pool.engine_pool_stats().items()
+                      for state in ("free", "in_use")}
+)
+
+# the totals of the search statistics of the ai moves by ai type (see GameManager.search_stats), rates and averages such
+# as the nodes per second or the table hit rate are found from them by the metrics' reader
+ai_moves_by_source = metrics.Counter(
+    "chess_ai_search_moves_total", "AI moves, by AI type and whether they were searched, from the book or cached.",
+    ["engine", "source"],
+    function=lambda: {(engine, source): totals[field] for engine, totals in manager.search_stats().items()
+                      for source, field in (("search", "searches"), ("book", "book_moves"), ("cache", "cache_hits"))}
+)
+ai_search_totals = [
+    metrics.Counter(
+        "chess_ai_search_" + name + "_total", documentation, ["engine"],
+        function=lambda field=field: {(engine,): totals[field] for engine, totals in manager.search_stats().items()}
+    )
+    for field, name, documentation in (
+        ("elapsed", "seconds", "Time spent searching AI moves, by AI type."),
+        ("nodes", "nodes", "Positions visited by AI searches, by AI type."),
+        ("leaf_evals", "leaf_evals", "Positions scored by the evaluation in AI searches, by AI type."),
+        ("depth", "depth", "Sum of the depths reached by AI searches, by AI type."),
+        ("beta_cutoffs", "beta_cutoffs", "Beta cutoffs in AI searches, by AI type."),
+        ("first_move_cutoffs", "first_move_cutoffs", "Beta cutoffs made by the first move searched, by AI type."),
+        ("tt_probes", "tt_probes", "Transposition table lookups in AI searches, by AI type."),
+        ("tt_hits", "tt_hits", "Transposition table lookups which found the position, by AI type."),
+        ("tt_cutoffs", "tt_cutoffs", "Searches of a position ended by its transposition table entry, by AI type."),
+    )
+]
+
+# the search budget of the minimax AIs, they search deeper each iteration until they reach the max depth (two plies
+# beyond the depth they used to search to, so simple positions finish early rather than using the whole move time) or
+# run out of time, and play the best move of the deepest iteration they completed
+AI_MAX_DEPTH = 6
+AI_MOVE_TIME = 3.0
+
+# the number of worker processes each minimax search is split across (0 searches in the request's thread)
+AI_SEARCH_WORKERS = 0
+
+# the most random games the monte carlo AI plays for each move (within the same time limit as the minimax AIs) and the
+# number of worker processes it plays them in (0 plays them in the request's thread)
+AI_PLAYOUTS = 2000
+AI_PLAYOUT_WORKERS = 0
+
+# the number of worker processes the AIs search in so that searches do not block the server (0, the default, searches
+# in the server's threads with the AIs shared through the engine pools), each worker keeps its own AIs and search cache
+# so the games' searches are only shared within a worker, the AIs should not also search in their own worker processes
+# when this is used
+AI_PROCESS_WORKERS = int(os.environ.get("AI_PROCESS_WORKERS", 0))
+
+# the most AIs of each type and settings kept for the games to share (0 creates an AI for each game), each move checks
+# an AI out of the pool so this is also the most moves of each AI type made at once
+AI_ENGINE_POOL_SIZE = 8
+
+# whether the search statistics of each ai move are sent to the players with the move
+SEND_SEARCH_STATS = False
+
+# the path of the polyglot opening book the searching AIs play from before searching (build one from PGN files with
+# opening_book.py), None to always search
+OPENING_BOOK = None
+
 
 @app.route('/')
 def homepage():
@@ -81,12 +174,18 @@ def create_ai_vs_ai_game():
     return redirect('/play/ai-vs-ai/' + session_url)
 
 
+@app.route('/metrics')
+def metrics_page():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/play/player-vs-ai/<game_session>')
 def play_player_vs_ai(game_session):
     if not manager.check_session(game_session):
         return redirect('')
 
-    return render_template("play/player-ai.html", data=manager.player_data(game_session))
+    return render_template("play/player-ai.html", data=manager.player_data(game_session),
+                           socket_options=SOCKETIO_CLIENT_OPTIONS)
 
 
 @app.route('/play/ai-vs-ai/<game_session>')
@@ -94,11 +193,13 @@ def play_ai_vs_ai(game_session):
     if not manager.check_session(game_session):
         return redirect('/')
 
-    return render_template("play/ai-ai.html", data=manager.player_data(game_session))
+    return render_template("play/ai-ai.html", data=manager.player_data(game_session),
+                           socket_options=SOCKETIO_CLIENT_OPTIONS)
 
 
 @socket_io.on('verify_move')
 def verify_move(data):
+    socket_events.inc("verify_move")
     verified, state, fen = manager.verify_move(data["session_url"], data)
 
     if state != "none":
@@ -109,6 +210,7 @@ def verify_move(data):
 
         # update the player
         emit('update_fen', response)
+        socket_messages.inc("update_fen")
 
         print("Game over! Reason: " + state)
 
@@ -125,82 +227,111 @@ def verify_move(data):
 
         # update the player
         emit('update_fen', response)
+        socket_messages.inc("update_fen")
     else:
         # make the ai move
-        pool.submit(threaded_ai_move, data)
+        scheduler.submit(data["session_url"], send_ai_move)
 
     return
 
 
 @socket_io.on('get_fen')
 def get_fen(data):
+    socket_events.inc("get_fen")
     response = {
         "fen": manager.get_fen(data["session_url"])
     }
 
     emit('give_fen', response)
+    socket_messages.inc("give_fen")
     return
 
 
 @socket_io.on('ai_move')
 def ai_move(data):
+    socket_events.inc("ai_move")
+
     # make the ai move
-    pool.submit(threaded_ai_move, data)
+    scheduler.submit(data["session_url"], send_ai_move)
     return
 
 
 @socket_io.on('join_game')
 def on_join(data):
+    socket_events.inc("join_game")
     join_room(data["session_url"])
 
 
-def threaded_ai_move(data):
-    try:
-        # make the ai move
-        fen, state, move = manager.ai_move(data["session_url"])
+# sends an ai move made by the scheduler to the game's players
+def send_ai_move(session_url, fen, state, move, stats=None):
+    response = {
+        "fen": fen,
+        "state": state,
+        "move": move
+    }
 
-        if move is None:
-            return
+    # the statistics of the ai's search for the move
+    if SEND_SEARCH_STATS and stats is not None:
+        response["stats"] = stats.data()
 
-        response = {
-            "fen": fen,
-            "state": state,
-            "move": move
-        }
+    # update the player
+    socket_io.emit('update_fen', response, room=session_url)
+    socket_messages.inc("update_fen")
+    return
 
-        # update the player
-        socket_io.emit('update_fen', response, room=data["session_url"])
-        return
-    except Exception as e:
-        print("ERROR: ")
-        print(e)
+
+# create an AI engine, from a shared engine pool if AI_ENGINE_POOL_SIZE is set (the production path, the games' AIs and
+# search cache are shared by every game the server process serves) or in a worker process if AI_PROCESS_WORKERS is set
+# (for hosts where the searches holding the server's GIL slow down its requests)
+def create_engine(engine_type, **settings):
+    if AI_PROCESS_WORKERS > 0:
+        return ai_workers.ProcessAI(engine_type, AI_PROCESS_WORKERS, **settings)
+
+    if AI_ENGINE_POOL_SIZE > 0:
+        return engine_pool.PooledAI(engine_pool.get_engine_pool(engine_type, AI_ENGINE_POOL_SIZE, **settings))
+
+    return engine_type(**settings)
 
 
 def get_ai_by_name(ai_name):
     if ai_name == "random":
         ai = gm.AI(
-            chess_ai.RandomAI(),
+            create_engine(chess_ai.RandomAI),
             "Random AI",
+            ai_name,
         )
     elif ai_name == "point":
         ai = gm.AI(
-            chess_ai.PointAI(),
+            create_engine(chess_ai.PointAI),
             "Point AI",
+            ai_name,
         )
     elif ai_name == "advanced_point":
         ai = gm.AI(
-            chess_ai.AdvancedPointAI(),
+            create_engine(chess_ai.AdvancedPointAI),
             "Advanced Point AI",
+            ai_name,
         )
     elif ai_name == "minimax":
         ai = gm.AI(
-            chess_ai.MiniMaxAI(),
+            create_engine(chess_ai.MiniMaxAI, depth=AI_MAX_DEPTH, time_limit=AI_MOVE_TIME, workers=AI_SEARCH_WORKERS,
+                          book=OPENING_BOOK, shared_cache=True),
             "Minmax AI",
+            ai_name,
         )
     elif ai_name == "advanced_minimax":
         ai = gm.AI(
-            chess_ai.AdvancedMiniMaxAI(),
+            create_engine(chess_ai.AdvancedMiniMaxAI, depth=AI_MAX_DEPTH, time_limit=AI_MOVE_TIME,
+                          workers=AI_SEARCH_WORKERS, book=OPENING_BOOK, shared_cache=True),
             "Advanced Minmax AI",
+            ai_name,
+        )
+    elif ai_name == "monte_carlo":
+        ai = gm.AI(
+            create_engine(chess_ai.MonteCarloAI, playouts=AI_PLAYOUTS, time_limit=AI_MOVE_TIME,
+                          workers=AI_PLAYOUT_WORKERS, book=OPENING_BOOK),
+            "Monte Carlo AI",
+            ai_name,
         )
     else:
         ai = None
@@ -0,0 +1,204 @@
+import bisect
+import os
+import resource
+import threading
+
+"""
+    Metrics of the server, shown in the Prometheus text format by the /metrics page.
+
+    Metrics are created once at module level next to the code they measure and are added to the registry as they are
+    created. Counters, gauges and histograms are updated in place under their own lock so recording a value is only a
+    dict update. Values kept elsewhere (such as the number of games) are read through a function given to the metric
+    when the metrics are read.
+"""
+
+# the content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# the default histogram buckets (in seconds), from a few milliseconds to the longest an AI move should take
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# every metric which has been created, in the order they were created
+registry = []
+registry_lock = threading.Lock()
+
+
+# escape a label value for the text format
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+# format a value for the text format
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return repr(value)
+
+
+# the base of every metric, label_names are the names of the metric's labels and each value is kept under the tuple
+# of its label values, function (if given) is called whenever the metrics are read and returns either the metric's
+# value or a dict of label values to values (for values kept elsewhere)
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, label_names=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.function = function
+
+        self.values = {}
+        self.lock = threading.Lock()
+
+        # a metric without labels is shown from the start rather than once it has been recorded
+        if not self.label_names:
+            self.values[()] = self.initial_value()
+
+        with registry_lock:
+            registry.append(self)
+
+    # the value of a metric before anything is recorded
+    def initial_value(self):
+        return 0
+
+    # the text of the labels of a sample, extra is a list of (name, value) pairs added after the metric's labels
+    def label_text(self, label_values, extra=()):
+        pairs = list(zip(self.label_names, label_values)) + list(extra)
+
+        if not pairs:
+            return ""
+
+        return "{" + ",".join(name + "=\"" + escape_label(value) + "\"" for name, value in pairs) + "}"
+
+    # the samples of the metric as a list of (name, label text, value)
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+
+            if isinstance(values, dict):
+                values = list(values.items())
+            else:
+                values = [((), values)]
+        else:
+            with self.lock:
+                values = list(self.values.items())
+
+        return [(self.name, self.label_text(label_values), value) for label_values, value in values]
+
+    # the metric in the text format
+    def render(self):
+        lines = [
+            "# HELP " + self.name + " " + self.documentation.replace("\\", "\\\\").replace("\n", "\\n"),
+            "# TYPE " + self.name + " " + self.kind
+        ]
+
+        for name, labels, value in self.samples():
+            lines.append(name + labels + " " + format_value(value))
+
+        return "\n".join(lines)
+
+
+# a value which only goes up
+class Counter(Metric):
+    kind = "counter"
+
+    # add to the value of the counter with the given label values
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+# a value which can go up and down
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+# counts of observed values in buckets, buckets are the upper bounds of the buckets in increasing order (a bucket for
+# every value is added after them)
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets) + (float("inf"),)
+        super().__init__(name, documentation, label_names)
+
+    def initial_value(self):
+        return [[0] * len(self.buckets), 0.0]
+
+    # add an observed value to the histogram with the given label values, values are kept as [count in each bucket
+    # (not cumulative), sum of the values]
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.initial_value()
+                self.values[label_values] = counts
+
+            counts[0][index] += 1
+            counts[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = [(label_values, list(counts[0]), counts[1]) for label_values, counts in self.values.items()]
+
+        samples = []
+        for label_values, bucket_counts, total in values:
+            count = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                count += bucket_count
+                samples.append((self.name + "_bucket", self.label_text(label_values, [("le", format_value(bound))]),
+                                count))
+
+            samples.append((self.name + "_sum", self.label_text(label_values), total))
+            samples.append((self.name + "_count", self.label_text(label_values), count))
+
+        return samples
+
+
+# the resident memory of the process in bytes, the peak resident memory where the current value can not be read
+def resident_memory():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in KB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# the cpu time used by the process in seconds
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return usage.ru_utime + usage.ru_stime
+
+
+# the metrics of the process, read when the metrics are read
+process_resident_memory = Gauge("process_resident_memory_bytes", "Resident memory size in bytes.",
+                                function=resident_memory)
+process_cpu = Counter("process_cpu_seconds_total", "Total user and system CPU time spent in seconds.",
+                      function=cpu_seconds)
+
+
+# every metric in the text format
+def render():
+    with registry_lock:
+        metrics = list(registry)
+
+    return "\n".join(metric.render() for metric in metrics) + "\n"
@@ -0,0 +1,153 @@
+import argparse
+import os
+import random
+import struct
+import threading
+import chess
+import chess.pgn
+import chess.polyglot
+
+"""
+    Opening books for the AIs.
+
+    Books use the polyglot format: a file of 16 byte entries (zobrist hash of the position, move, weight, learn value)
+    sorted by hash. Books are read through a memory map so looking up a position is a binary search of the file, and
+    every process which opens the same book shares the same pages of memory.
+
+    Build a book from a collection of PGN files with:
+        python opening_book.py book.bin games.pgn [more_games.pgn ...] [--max-ply 16] [--min-games 2]
+"""
+
+# the layout of a book entry
+ENTRY_STRUCT = struct.Struct(">QHHI")
+
+# the largest weight an entry can have
+MAX_WEIGHT = 0xFFFF
+
+# the books opened by this process, keyed by their path
+books = {}
+books_lock = threading.Lock()
+
+
+# an opening book read through a memory map
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.reader = chess.polyglot.open_reader(path)
+
+    # get a book move for the position of an AI's board (looked up by the polyglot zobrist hash the board keeps), chosen
+    # at random by weight (or the highest weighted move if random_choice is False), returns None if the position is not
+    # in the book or the move is not legal (a hash collision)
+    def probe(self, board, random_choice=True):
+        entries = list(self.reader.find_all(board.zobrist))
+
+        if not entries:
+            return None
+
+        if not random_choice:
+            entry = max(entries, key=lambda entry: entry.weight)
+        else:
+            entry = random.choices(entries, weights=[entry.weight for entry in entries])[0]
+
+        move = decode_move(board, entry.move)
+        if not board.is_legal(move):
+            return None
+
+        return move
+
+    def close(self):
+        self.reader.close()
+
+    def __len__(self):
+        return len(self.reader)
+
+
+# get the opening book at a path, each book is only opened once per process
+def get_book(path):
+    with books_lock:
+        if path not in books:
+            books[path] = OpeningBook(path)
+
+        return books[path]
+
+
+# the polyglot encoding of a move, castling is stored as the king capturing its own rook
+def encode_move(board, move):
+    to_square = move.to_square
+
+    if board.is_castling(move):
+        if chess.square_file(move.to_square) > chess.square_file(move.from_square):
+            to_square = chess.square(7, chess.square_rank(move.from_square))
+        else:
+            to_square = chess.square(0, chess.square_rank(move.from_square))
+
+    raw_move = to_square | (move.from_square << 6)
+
+    if move.promotion:
+        raw_move |= (move.promotion - 1) << 12
+
+    return raw_move
+
+
+# the move of a polyglot encoded move on a board, castling is stored as the king capturing its own rook
+def decode_move(board, move):
+    if board.piece_type_at(move.from_square) == chess.KING and \
+            board.occupied_co[board.turn] & chess.BB_SQUARES[move.to_square]:
+        if chess.square_file(move.to_square) > chess.square_file(move.from_square):
+            return chess.Move(move.from_square, move.from_square + 2)
+
+        return chess.Move(move.from_square, move.from_square - 2)
+
+    return move
+
+
+# build a book from the first max_ply moves of the games in a list of PGN files, a move is only added if it was played
+# in at least min_games games and its weight is the number of games it was played in
+def build_book(book_path, pgn_paths, max_ply=16, min_games=2):
+    # the number of games each move was played in, keyed by (position hash, encoded move)
+    counts = {}
+
+    for pgn_path in pgn_paths:
+        with open(pgn_path, encoding="utf-8", errors="replace") as pgn:
+            while True:
+                game = chess.pgn.read_game(pgn)
+
+                if game is None:
+                    break
+
+                board = game.board()
+
+                for ply, move in enumerate(game.mainline_moves()):
+                    if ply >= max_ply:
+                        break
+
+                    entry = (chess.polyglot.zobrist_hash(board), encode_move(board, move))
+                    counts[entry] = counts.get(entry, 0) + 1
+
+                    board.push(move)
+
+    # entries are sorted by hash and then by weight so the best move of a position comes first
+    entries = sorted(((key, raw_move, min(count, MAX_WEIGHT)) for (key, raw_move), count in counts.items()
+                      if count >= min_games), key=lambda entry: (entry[0], -entry[2]))
+
+    # write to a temporary file first so that processes with the book open never see a partly written book
+    temp_path = book_path + ".tmp"
+    with open(temp_path, "wb") as book:
+        for key, raw_move, weight in entries:
+            book.write(ENTRY_STRUCT.pack(key, raw_move, weight, 0))
+    os.replace(temp_path, book_path)
+
+    return len(entries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a polyglot opening book from PGN files.")
+    parser.add_argument("book", help="the path to write the book to")
+    parser.add_argument("pgn", nargs="+", help="the PGN files to read games from")
+    parser.add_argument("--max-ply", type=int, default=16, help="the number of moves of each game to add")
+    parser.add_argument("--min-games", type=int, default=2, help="the number of games a move must be played in")
+    args = parser.parse_args()
+
+    num_entries = build_book(args.book, args.pgn, args.max_ply, args.min_games)
+
+    print("Wrote " + str(num_entries) + " entries to " + args.book)
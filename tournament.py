@@ -0,0 +1,450 @@
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import random
+import time
+import chess
+import chess.pgn
+import chess_ai
+import game_manager as gm
+
+"""
+    Headless AI vs AI tournaments.
+
+    Plays every pairing of the given AIs from a fixed set of openings, each opening is played twice with the colors
+    swapped. Games are played in a pool of worker processes and each game is written to a PGN and/or JSONL file as soon
+    as it finishes. At the end the score of each pairing is printed with its Elo difference and error margin.
+
+    With two AIs a sequential probability ratio test can be run for the first AI against the second, the tournament
+    stops as soon as the test passes (the first AI is at least elo1 stronger) or fails (it is at most elo0 stronger).
+
+    AIs are given by name (see ENGINES) with optional settings after a colon:
+        python tournament.py minimax:depth=3 advanced_minimax:depth=3 [--rounds 2] [--workers 4] [--pgn games.pgn]
+            [--jsonl games.jsonl] [--openings openings.pgn] [--opening-plies 8] [--max-plies 300]
+            [--sprt -5 5] [--alpha 0.05] [--beta 0.05]
+"""
+
+# the AIs which can play in a tournament, keyed by the names used by the web app
+ENGINES = {
+    "random": chess_ai.RandomAI,
+    "point": chess_ai.PointAI,
+    "advanced_point": chess_ai.AdvancedPointAI,
+    "minimax": chess_ai.MiniMaxAI,
+    "advanced_minimax": chess_ai.AdvancedMiniMaxAI,
+    "monte_carlo": chess_ai.MonteCarloAI
+}
+
+# the openings played when no openings file is given (as uci moves), a mix of open, semi-open and closed games
+OPENINGS = [
+    ("Ruy Lopez", "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6"),
+    ("Italian Game", "e2e4 e7e5 g1f3 b8c6 f1c4 f8c5"),
+    ("Scotch Game", "e2e4 e7e5 g1f3 b8c6 d2d4 e5d4"),
+    ("Petrov Defence", "e2e4 e7e5 g1f3 g8f6 f3e5 d7d6"),
+    ("Sicilian Najdorf", "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6"),
+    ("Sicilian Taimanov", "e2e4 c7c5 g1f3 e7e6 d2d4 c5d4 f3d4 b8c6"),
+    ("French Defence", "e2e4 e7e6 d2d4 d7d5 b1c3 g8f6"),
+    ("Caro-Kann Defence", "e2e4 c7c6 d2d4 d7d5 e4e5 c8f5"),
+    ("Scandinavian Defence", "e2e4 d7d5 e4d5 d8d5 b1c3 d5a5"),
+    ("Queen's Gambit Declined", "d2d4 d7d5 c2c4 e7e6 b1c3 g8f6"),
+    ("Slav Defence", "d2d4 d7d5 c2c4 c7c6 g1f3 g8f6"),
+    ("King's Indian Defence", "d2d4 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6"),
+    ("Nimzo-Indian Defence", "d2d4 g8f6 c2c4 e7e6 b1c3 f8b4"),
+    ("Dutch Defence", "d2d4 f7f5 g2g3 g8f6 f1g2 e7e6"),
+    ("English Opening", "c2c4 e7e5 b1c3 g8f6 g1f3 b8c6"),
+    ("Reti Opening", "g1f3 d7d5 c2c4 e7e6 g2g3 g8f6")
+]
+
+# the game results as the score of the white player
+RESULT_SCORES = {"1-0": 1.0, "1/2-1/2": 0.5, "0-1": 0.0}
+
+# the z score of a 95% confidence interval
+CONFIDENCE_Z = 1.96
+
+
+# parse an AI given as "name" or "name:setting=value,setting=value", returns the AI's name and settings
+def parse_engine(spec):
+    name, _, setting_list = spec.partition(":")
+
+    if name not in ENGINES:
+        raise ValueError("unknown AI '" + name + "', expected one of: " + ", ".join(ENGINES))
+
+    settings = {}
+    for setting in filter(None, setting_list.split(",")):
+        key, _, value = setting.partition("=")
+        settings[key] = parse_value(value)
+
+    return name, settings
+
+
+# convert a setting's value to an int, float, bool or None where it looks like one
+def parse_value(value):
+    if value in ("None", "none"):
+        return None
+    if value in ("True", "true"):
+        return True
+    if value in ("False", "false"):
+        return False
+
+    for value_type in (int, float):
+        try:
+            return value_type(value)
+        except ValueError:
+            pass
+
+    return value
+
+
+# read the openings from a PGN file, each game's main line is cut to max_plies moves, returns (name, uci moves) pairs
+def read_openings(path, max_plies):
+    openings = []
+
+    with open(path) as pgn:
+        while True:
+            game = chess.pgn.read_game(pgn)
+            if game is None:
+                break
+
+            moves = [move.uci() for move in game.mainline_moves()][:max_plies]
+            if not moves:
+                continue
+
+            name = game.headers.get("Opening") or game.headers.get("Event") or "Opening " + str(len(openings) + 1)
+            openings.append((name, " ".join(moves)))
+
+    return openings
+
+
+# the list of games of a tournament, each pairing plays each opening twice a round with the colors swapped
+def schedule_games(engines, openings, rounds):
+    games = []
+
+    for tournament_round in range(rounds):
+        for opening_name, opening_moves in openings:
+            for first in range(len(engines)):
+                for second in range(first + 1, len(engines)):
+                    for white, black in ((first, second), (second, first)):
+                        games.append({
+                            "id": len(games) + 1,
+                            "round": tournament_round + 1,
+                            "white": engines[white],
+                            "black": engines[black],
+                            "opening": opening_name,
+                            "opening_moves": opening_moves
+                        })
+
+    return games
+
+
+# play a game between two AIs (run in a worker process), returns the game's record as a dict
+def play_game(game, max_plies, seed):
+    random.seed(seed)
+    start = time.perf_counter()
+
+    # the board the game manager uses so games end by the same rules as games on the server
+    board = gm.GameManager.Game.CustomBoard()
+    for move in game["opening_moves"].split():
+        board.push(chess.Move.from_uci(move))
+
+    players = {}
+    for color, key in ((chess.WHITE, "white"), (chess.BLACK, "black")):
+        name, settings = parse_engine(game[key]["spec"])
+        players[color] = ENGINES[name](color="w" if color == chess.WHITE else "b", **settings)
+
+    move_times = {chess.WHITE: 0.0, chess.BLACK: 0.0}
+    result = None
+    termination = None
+
+    while True:
+        state = board.game_state()
+
+        if state == "checkmate":
+            result = "0-1" if board.turn == chess.WHITE else "1-0"
+            termination = state
+            break
+        elif state != "none":
+            result = "1/2-1/2"
+            termination = state
+            break
+        elif len(board.move_stack) >= max_plies:
+            result = "1/2-1/2"
+            termination = "max_plies"
+            break
+
+        color = board.turn
+        move_start = time.perf_counter()
+        move = players[color].get_move(board.fen(), moves=list(board.move_stack))
+        move_times[color] += time.perf_counter() - move_start
+
+        # an AI which has no move or plays an illegal move loses the game
+        if move is None or not board.is_legal(move):
+            result = "0-1" if color == chess.WHITE else "1-0"
+            termination = "illegal_move"
+            break
+
+        board.push(move)
+
+    return {
+        "id": game["id"],
+        "round": game["round"],
+        "white": game["white"]["label"],
+        "black": game["black"]["label"],
+        "opening": game["opening"],
+        "moves": [move.uci() for move in board.move_stack],
+        "result": result,
+        "termination": termination,
+        "plies": len(board.move_stack),
+        "seconds": time.perf_counter() - start,
+        "white_seconds": move_times[chess.WHITE],
+        "black_seconds": move_times[chess.BLACK]
+    }
+
+
+# the PGN of a finished game
+def game_pgn(record, event):
+    board = chess.Board()
+    for move in record["moves"]:
+        board.push(chess.Move.from_uci(move))
+
+    game = chess.pgn.Game.from_board(board)
+    game.headers["Event"] = event
+    game.headers["Site"] = "tournament.py"
+    game.headers["Date"] = time.strftime("%Y.%m.%d")
+    game.headers["Round"] = str(record["round"])
+    game.headers["White"] = record["white"]
+    game.headers["Black"] = record["black"]
+    game.headers["Result"] = record["result"]
+    game.headers["Opening"] = record["opening"]
+    game.headers["Termination"] = record["termination"]
+
+    return str(game)
+
+
+# the expected score of a player with an Elo advantage
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+# the Elo advantage of a player with an expected score
+def score_elo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+
+    return -400 * math.log10(1 / score - 1)
+
+
+# the mean and variance of the score of a game from wins, draws and losses
+def score_stats(wins, draws, losses):
+    games = wins + draws + losses
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+
+    return score, variance
+
+
+# the Elo difference shown by wins, draws and losses and the margin of its 95% confidence interval
+def elo_difference(wins, draws, losses):
+    games = wins + draws + losses
+    if not games:
+        return 0.0, None
+
+    score, variance = score_stats(wins, draws, losses)
+    error = CONFIDENCE_Z * math.sqrt(variance / games)
+
+    margin = (score_elo(score + error) - score_elo(score - error)) / 2
+
+    return score_elo(score), margin
+
+
+# the log likelihood ratio of the hypotheses that a player is elo1 stronger rather than elo0 stronger (the
+# approximation of the generalised SPRT used by fishtest)
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    games = wins + draws + losses
+    if not games:
+        return 0.0
+
+    score, variance = score_stats(wins, draws, losses)
+    if not variance:
+        return 0.0
+
+    score0 = expected_score(elo0)
+    score1 = expected_score(elo1)
+
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+# the bounds of the log likelihood ratio at which an SPRT stops, (lower, upper)
+def sprt_bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+# a tally of the results of every pairing, from the point of view of the first AI of the pairing
+class Standings:
+    def __init__(self, labels):
+        self.labels = labels
+        self.results = {}
+
+        for first in range(len(labels)):
+            for second in range(first + 1, len(labels)):
+                self.results[(labels[first], labels[second])] = [0, 0, 0]
+
+    # add the result of a finished game
+    def add(self, record):
+        if (record["white"], record["black"]) in self.results:
+            pairing = self.results[(record["white"], record["black"])]
+            score = RESULT_SCORES[record["result"]]
+        else:
+            pairing = self.results[(record["black"], record["white"])]
+            score = 1 - RESULT_SCORES[record["result"]]
+
+        if score == 1:
+            pairing[0] += 1
+        elif score == 0.5:
+            pairing[1] += 1
+        else:
+            pairing[2] += 1
+
+    # the wins, draws and losses of the first AI in a pairing
+    def pairing(self, first, second):
+        return tuple(self.results[(first, second)])
+
+    # the standings as a dict of "first vs second" to the pairing's results and Elo difference
+    def summary(self):
+        summary = {}
+
+        for (first, second), (wins, draws, losses) in self.results.items():
+            elo, margin = elo_difference(wins, draws, losses)
+
+            summary[first + " vs " + second] = {
+                "wins": wins,
+                "draws": draws,
+                "losses": losses,
+                "elo": elo,
+                "margin": margin
+            }
+
+        return summary
+
+
+# play a tournament, writing each game to the output files as it finishes, returns the standings (and the SPRT result
+# if sprt is a pair of (elo0, elo1))
+def run_tournament(engines, openings, rounds=1, workers=None, max_plies=300, seed=0, pgn_path=None,
+                   jsonl_path=None, sprt=None, alpha=0.05, beta=0.05, log=print):
+    games = schedule_games(engines, openings, rounds)
+    labels = [engine["label"] for engine in engines]
+    standings = Standings(labels)
+    event = " vs ".join(labels)
+
+    if sprt is not None:
+        lower, upper = sprt_bounds(alpha, beta)
+    sprt_result = None
+
+    pgn_file = open(pgn_path, "a") if pgn_path else None
+    jsonl_file = open(jsonl_path, "a") if jsonl_path else None
+
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+    try:
+        futures = [executor.submit(play_game, game, max_plies, seed + game["id"]) for game in games]
+        finished = 0
+
+        for future in concurrent.futures.as_completed(futures):
+            record = future.result()
+            finished += 1
+            standings.add(record)
+
+            if pgn_file is not None:
+                pgn_file.write(game_pgn(record, event) + "\n\n")
+                pgn_file.flush()
+            if jsonl_file is not None:
+                jsonl_file.write(json.dumps(record) + "\n")
+                jsonl_file.flush()
+
+            log("Game " + str(finished) + "/" + str(len(games)) + ": " + record["white"] + " vs " + record["black"] +
+                " " + record["result"] + " (" + record["termination"] + ", " + str(record["plies"]) + " plies)")
+
+            if sprt is not None:
+                llr = sprt_llr(*standings.pairing(labels[0], labels[1]), sprt[0], sprt[1])
+
+                if llr >= upper:
+                    sprt_result = "H1 accepted"
+                elif llr <= lower:
+                    sprt_result = "H0 accepted"
+
+                if sprt_result is not None:
+                    log("SPRT " + sprt_result + " (LLR " + format(llr, ".2f") + ")")
+
+                    # the games which have not started are not needed
+                    for pending in futures:
+                        pending.cancel()
+                    break
+    finally:
+        executor.shutdown(wait=True)
+
+        if pgn_file is not None:
+            pgn_file.close()
+        if jsonl_file is not None:
+            jsonl_file.close()
+
+    return standings, sprt_result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play a tournament between chess AIs.")
+    parser.add_argument("engines", nargs="+",
+                        help="the AIs to play, as name or name:setting=value,... (names: " + ", ".join(ENGINES) + ")")
+    parser.add_argument("--rounds", type=int, default=1, help="the number of times each opening is played")
+    parser.add_argument("--workers", type=int, default=None, help="the number of worker processes (default: cpus)")
+    parser.add_argument("--openings", help="a PGN file of openings (default: a built in set of openings)")
+    parser.add_argument("--opening-plies", type=int, default=8, help="the number of moves of each opening to play")
+    parser.add_argument("--max-plies", type=int, default=300, help="the length at which a game is adjudicated a draw")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the random AIs")
+    parser.add_argument("--pgn", help="the path of a PGN file to append the games to")
+    parser.add_argument("--jsonl", help="the path of a JSONL file to append the games to")
+    parser.add_argument("--sprt", nargs=2, type=float, metavar=("ELO0", "ELO1"),
+                        help="run an SPRT of the first AI against the second (requires exactly two AIs)")
+    parser.add_argument("--alpha", type=float, default=0.05, help="the false positive rate of the SPRT")
+    parser.add_argument("--beta", type=float, default=0.05, help="the false negative rate of the SPRT")
+    args = parser.parse_args()
+
+    if len(args.engines) < 2:
+        parser.error("at least two AIs are needed")
+    if args.sprt is not None and len(args.engines) != 2:
+        parser.error("an SPRT needs exactly two AIs")
+
+    tournament_engines = []
+    for engine_spec in args.engines:
+        try:
+            parse_engine(engine_spec)
+        except ValueError as error:
+            parser.error(str(error))
+
+        # the same AI can play itself, each entry gets its own label
+        label = engine_spec
+        if any(engine["label"] == label for engine in tournament_engines):
+            label += "#" + str(len(tournament_engines) + 1)
+
+        tournament_engines.append({"spec": engine_spec, "label": label})
+
+    if args.openings:
+        tournament_openings = read_openings(args.openings, args.opening_plies)
+    else:
+        tournament_openings = [(name, " ".join(moves.split()[:args.opening_plies])) for name, moves in OPENINGS]
+
+    tournament_standings, tournament_sprt = run_tournament(
+        tournament_engines, tournament_openings, args.rounds, args.workers, args.max_plies, args.seed, args.pgn,
+        args.jsonl, args.sprt, args.alpha, args.beta
+    )
+
+    print()
+    for pairing_name, pairing_result in tournament_standings.summary().items():
+        line = pairing_name + ": +" + str(pairing_result["wins"]) + " =" + str(pairing_result["draws"]) + \
+               " -" + str(pairing_result["losses"]) + ", Elo " + format(pairing_result["elo"], "+.1f")
+
+        if pairing_result["margin"] is not None:
+            line += " +/- " + format(pairing_result["margin"], ".1f")
+
+        print(line)
+
+    if args.sprt is not None:
+        print("SPRT: " + (tournament_sprt or "inconclusive"))